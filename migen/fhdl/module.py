@@ -1,5 +1,4 @@
 import collections
-from itertools import combinations
 
 from migen.util.misc import flat_iteration
 from migen.fhdl.structure import *  # noqa
@@ -159,17 +158,18 @@ class Module:
             # finalize submodules created by do_finalize
             subfragments += self._collect_submodules()
             # resolve clock domain name conflicts
+            cd_modules = collections.defaultdict(list)
+            for mod_name, f in subfragments:
+                for cd_name in set(cd.name for cd in f.clock_domains):
+                    cd_modules[cd_name].append(mod_name)
             needs_renaming = set()
-            for (mod_name1, f1), (mod_name2, f2) in combinations(subfragments, 2):
-                f1_names = set(cd.name for cd in f1.clock_domains)
-                f2_names = set(cd.name for cd in f2.clock_domains)
-                common_names = f1_names & f2_names
-                if common_names:
-                    if mod_name1 is None or mod_name2 is None:
+            for cd_name, mod_names in cd_modules.items():
+                if len(mod_names) > 1:
+                    if None in mod_names:
                         raise ValueError("Multiple submodules with local clock domains cannot be anonymous")
-                    if mod_name1 == mod_name2:
+                    if len(set(mod_names)) < len(mod_names):
                         raise ValueError("Multiple submodules with local clock domains cannot have the same name")
-                needs_renaming |= common_names
+                    needs_renaming.add(cd_name)
             for mod_name, f in subfragments:
                 for cd in f.clock_domains:
                     if cd.name in needs_renaming:
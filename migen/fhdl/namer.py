@@ -1,10 +1,14 @@
-from collections import OrderedDict
-from itertools import combinations
+import json
+from collections import OrderedDict, defaultdict
 
 from migen.fhdl.structure import *  # noqa
+from migen.fhdl import tracer
 
 
 class _Node:
+    __slots__ = ("signal_count", "numbers", "use_name", "use_number",
+                 "children", "number_index")
+
     def __init__(self):
         self.signal_count = 0
         self.numbers = set()
@@ -57,19 +61,34 @@ def _build_tree(signals, basic_tree=None):
                 new = _Node()
                 current.children[key] = new
                 current = new
+                if use_number:
+                    current.number_index = _number_index(current_b)
             current.numbers.add(number)
-            if use_number:
-                current.all_numbers = sorted(current_b.numbers)
             current.signal_count += 1
     return root
 
 
+def _number_index(node):
+    # position of each number of a node of the basic tree, shared by the
+    # numbered nodes it is split into
+    try:
+        return node.number_index
+    except AttributeError:
+        node.number_index = {number: i for i, number
+                             in enumerate(sorted(node.numbers))}
+        return node.number_index
+
+
 def _set_use_name(node, node_name=""):
     cnames = [(k, _set_use_name(v, k)) for k, v in node.children.items()]
-    for (c1_prefix, c1_names), (c2_prefix, c2_names) in combinations(cnames, 2):
-        if not c1_names.isdisjoint(c2_names):
-            node.children[c1_prefix].use_name = True
-            node.children[c2_prefix].use_name = True
+    # children that have names in common use their own name
+    owners = dict()
+    for c_prefix, c_names in cnames:
+        for c_name in c_names:
+            owner = owners.setdefault(c_name, c_prefix)
+            if owner != c_prefix:
+                node.children[owner].use_name = True
+                node.children[c_prefix].use_name = True
     r = set()
     for c_prefix, c_names in cnames:
         if node.children[c_prefix].use_name:
@@ -98,7 +117,7 @@ def _name_signal(tree, signal):
         if treepos.use_name:
             elname = step_name
             if use_number:
-                elname += str(treepos.all_numbers.index(step_n))
+                elname += str(treepos.number_index[step_n])
             elements.append(elname)
     return "_".join(elements)
 
@@ -214,9 +233,96 @@ def _build_pnd(signals):
     return pnd
 
 
-def build_namespace(signals, reserved_keywords=set()):
-    pnd = _build_pnd(signals)
-    ns = Namespace(pnd, reserved_keywords)
+def _module_paths(top):
+    # backtrace step of each module under `top` -> path in the hierarchy,
+    # or None for the modules that cannot be told apart from their
+    # siblings (anonymous submodules of the same class)
+    paths = dict()
+
+    def walk(module, path):
+        step = tracer.object_step(module)
+        if step is not None:
+            paths[step] = path
+        named = defaultdict(list)
+        anonymous = defaultdict(list)
+        for name, submodule in module._submodules:
+            if name is None:
+                anonymous[type(submodule).__name__.lower()].append(submodule)
+            else:
+                named[name].append(submodule)
+        for name, submodules in named.items():
+            for i, submodule in enumerate(submodules):
+                if path is None:
+                    walk(submodule, None)
+                elif len(submodules) == 1:
+                    walk(submodule, path + [name])
+                else:
+                    walk(submodule, path + ["{}[{}]".format(name, i)])
+        for classname, submodules in anonymous.items():
+            for submodule in submodules:
+                if path is None or len(submodules) > 1:
+                    walk(submodule, None)
+                else:
+                    walk(submodule, path + ["({})".format(classname)])
+
+    walk(top, [])
+    return paths
+
+
+def _signal_keys(signals, top):
+    # Signals are identified across builds by the path of the module that
+    # created them in the hierarchy of `top`, the names in their backtrace
+    # below that module, and their rank among the signals of the module
+    # with the same names. Signals of modules that cannot be identified,
+    # or not created by a module, have no key.
+    if top is None:
+        return dict()
+    paths = _module_paths(top)
+    groups = defaultdict(list)
+    for signal in signals:
+        if signal.name_override is not None:
+            continue
+        backtrace = signal.backtrace
+        for i in reversed(range(len(backtrace))):
+            if backtrace[i] in paths:
+                path = paths[backtrace[i]]
+                if path is not None:
+                    groups["/".join(path) + ":" + "/".join(
+                        name for name, number in backtrace[i + 1:])
+                    ].append(signal)
+                break
+    keys = dict()
+    for group, group_signals in groups.items():
+        for rank, signal in enumerate(sorted(group_signals, key=hash)):
+            keys[signal] = "{}#{}".format(group, rank)
+    return keys
+
+
+def build_namespace(signals, reserved_keywords=set(), names=None, top=None):
+    """Name signals for code generation
+
+    `names` maps signal keys to the names to give them, as returned by
+    `read_names` for a file written by `Namespace.write_names` after a
+    previous build of the module `top`. Signals found in it keep their
+    names, unless a signal with `name_override` now takes it. The others
+    are named from their backtraces, avoiding the names already taken.
+    """
+    if names is None:
+        fixed = dict()
+        pnd = _build_pnd(signals)
+    else:
+        overrides = {signal.name_override for signal in signals
+                     if signal.name_override is not None}
+        fixed = dict()
+        for signal, key in _signal_keys(signals, top).items():
+            name = names.get(key)
+            if name is not None and name not in overrides:
+                fixed[signal] = name
+        pnd = _build_pnd([signal for signal in signals
+                          if signal not in fixed])
+    ns = Namespace(pnd, reserved_keywords, fixed)
+    ns._signals = signals
+    ns._top = top
     # register signals with name_override
     swno = {signal for signal in signals if signal.name_override is not None}
     for signal in sorted(swno, key=hash):
@@ -224,12 +330,23 @@ def build_namespace(signals, reserved_keywords=set()):
     return ns
 
 
+def read_names(filename):
+    """Read a name map written by `Namespace.write_names`"""
+    with open(filename) as f:
+        return json.load(f)
+
+
 class Namespace:
-    def __init__(self, pnd, reserved_keywords=set()):
+    def __init__(self, pnd, reserved_keywords=set(), fixed=None):
         self.counts = {k: 1 for k in reserved_keywords}
         self.sigs = {}
         self.pnd = pnd
         self.clock_domains = dict()
+        # signal -> name kept from a previous build
+        self.fixed = dict() if fixed is None else fixed
+        self.taken = set(self.fixed.values())
+        self._signals = ()
+        self._top = None
 
     def get_name(self, sig):
         if isinstance(sig, ClockSignal):
@@ -240,6 +357,13 @@ class Namespace:
                 raise ValueError("Attempted to obtain name of non-existent "
                                  "reset signal of domain {}".format(sig.cd))
 
+        try:
+            name = self.fixed[sig]
+        except KeyError:
+            pass
+        else:
+            self.sigs[sig] = 0
+            return name
         if sig.name_override is not None:
             sig_name = sig.name_override
         else:
@@ -251,9 +375,25 @@ class Namespace:
                 n = self.counts[sig_name]
             except KeyError:
                 n = 0
+            if self.taken:
+                while (sig_name + "_" + str(n) if n else sig_name) \
+                        in self.taken:
+                    n += 1
             self.sigs[sig] = n
             self.counts[sig_name] = n + 1
         if n:
             return sig_name + "_" + str(n)
         else:
             return sig_name
+
+    def names(self):
+        """Return the names given so far, by signal key"""
+        keys = _signal_keys(self._signals, self._top)
+        return {key: self.get_name(signal)
+                for signal, key in keys.items() if signal in self.sigs}
+
+    def write_names(self, filename):
+        """Write the names given so far, for `build_namespace` to keep
+        them in later builds"""
+        with open(filename, "w") as f:
+            json.dump(self.names(), f, indent=0, sort_keys=True)
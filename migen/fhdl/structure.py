@@ -15,6 +15,7 @@ __all__ = [
 
 class DUID:
     """Deterministic Unique IDentifier"""
+    __slots__ = ("_duid", )
     __duid = itertools.count(0)
 
     def __init__(self):
@@ -35,6 +36,8 @@ class _Value(DUID):
     Values created from integers have the minimum bit width to necessary to
     represent the integer.
     """
+    __slots__ = ()
+
     def __bool__(self):
         # Special case: Constants and Signals are part of a set or used as
         # dictionary keys, and Python needs to check for equality.
@@ -193,6 +196,8 @@ def wrap(value):
 
 
 class _Operator(_Value):
+    __slots__ = ("op", "operands")
+
     def __init__(self, op, operands):
         super().__init__()
         self.op = op
@@ -220,6 +225,8 @@ def Mux(sel, val1, val0):
 
 
 class _Slice(_Value):
+    __slots__ = ("value", "start", "stop")
+
     def __init__(self, value, start, stop):
         super().__init__()
         if not isinstance(start, int) or not isinstance(stop, int):
@@ -230,6 +237,8 @@ class _Slice(_Value):
 
 
 class _Part(_Value):
+    __slots__ = ("value", "offset", "width")
+
     def __init__(self, value, offset, width):
         _Value.__init__(self)
         if not isinstance(width, int):
@@ -268,6 +277,8 @@ class Cat(_Value):
     Cat, inout
         Resulting `_Value` obtained by concatentation.
     """
+    __slots__ = ("l", )
+
     def __init__(self, *args):
         super().__init__()
         self.l = [wrap(v) for v in _flat_iteration(args)]  # noqa
@@ -293,6 +304,8 @@ class Replicate(_Value):
     Replicate, out
         Replicated value.
     """
+    __slots__ = ("v", "n")
+
     def __init__(self, v, n):
         super().__init__()
         if not isinstance(n, int) or n < 0:
@@ -312,20 +325,45 @@ class Constant(_Value):
         specifying the number of bits in this `Constant` and whether it is
         signed (can represent negative values). `bits_sign` defaults
         to the minimum width and signedness of `value`.
+
+    Constants are immutable. Small constants are hash-consed: creating
+    one returns the existing object with the same value, width and
+    signedness, if any.
     """
-    def __init__(self, value, bits_sign=None):
-        from migen.fhdl.bitcontainer import bits_for
+    __slots__ = ("value", "nbits", "signed")
 
-        super().__init__()
+    def __new__(cls, value, bits_sign=None):
+        from migen.fhdl.bitcontainer import bits_for
 
-        self.value = int(value)
+        value = int(value)
         if bits_sign is None:
-            bits_sign = bits_for(self.value), self.value < 0
+            bits_sign = bits_for(value), value < 0
         elif isinstance(bits_sign, int):
-            bits_sign = bits_sign, self.value < 0
-        self.nbits, self.signed = bits_sign
-        if not isinstance(self.nbits, int) or self.nbits <= 0:
+            bits_sign = bits_sign, value < 0
+        nbits, signed = bits_sign
+        if not isinstance(nbits, int) or nbits <= 0:
             raise TypeError("Width must be a strictly positive integer")
+        key = value, nbits, signed
+        if cls is Constant:
+            try:
+                return _constants[key]
+            except KeyError:
+                pass
+        self = super().__new__(cls)
+        DUID.__init__(self)
+        self.value = value
+        self.nbits = nbits
+        self.signed = signed
+        if cls is Constant and -_CONSTANT_CACHE <= value < _CONSTANT_CACHE:
+            _constants[key] = self
+        return self
+
+    def __init__(self, value, bits_sign=None):
+        # initialized by __new__
+        pass
+
+    def __getnewargs__(self):
+        return self.value, (self.nbits, self.signed)
 
     def __hash__(self):
         return self.value
@@ -333,6 +371,10 @@ class Constant(_Value):
 
 C = Constant  # shorthand
 
+# constants with smaller magnitudes are hash-consed
+_CONSTANT_CACHE = 1 << 10
+_constants = dict()
+
 
 class Signal(_Value):
     """A `_Value` that can change
@@ -383,6 +425,12 @@ class Signal(_Value):
     related : Signal or None
     attr : set of synthesis attributes
     """
+    __slots__ = ("nbits", "signed", "variable", "_reset", "reset_less",
+                 "name_override", "_backtrace", "related", "attr",
+                 "__weakref__",
+                 # other attributes can still be attached to signals (the
+                 # dictionary is only created when one is)
+                 "__dict__")
     _name_re = _re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
 
     def __init__(self, bits_sign=None, name=None, variable=False, reset=0,
@@ -427,14 +475,28 @@ class Signal(_Value):
         self.reset = reset
         self.reset_less = reset_less
         self.name_override = name_override
-        self.backtrace = _tracer.trace_back(name)
+        self._backtrace = _tracer.capture(name)
         self.related = related
         self.attr = attr
 
-    def __setattr__(self, k, v):
-        if k == "reset":
-            v = wrap(v)
-        super().__setattr__(k, v)
+    @property
+    def backtrace(self):
+        backtrace = self._backtrace
+        if isinstance(backtrace, _tracer.Backtrace):
+            backtrace = self._backtrace = backtrace.build()
+        return backtrace
+
+    @backtrace.setter
+    def backtrace(self, backtrace):
+        self._backtrace = backtrace
+
+    @property
+    def reset(self):
+        return self._reset
+
+    @reset.setter
+    def reset(self, reset):
+        self._reset = wrap(reset)
 
     def __repr__(self):
         return "<Signal {} at <{:#0x}>".format(
@@ -508,10 +570,12 @@ class ResetSignal(_Value):
 
 
 class _Statement:
-    pass
+    __slots__ = ()
 
 
 class _Assign(_Statement):
+    __slots__ = ("l", "r")
+
     def __init__(self, l, r):
         self.l = wrap(l)  # noqa
         self.r = wrap(r)
@@ -548,6 +612,8 @@ class If(_Statement):
     ...     b.eq(d)
     ... )
     """
+    __slots__ = ("cond", "t", "f")
+
     def __init__(self, cond, *t):
         if not _check_statement(t):
             raise TypeError("Not all test body objects are Migen statements")
@@ -616,6 +682,8 @@ class Case(_Statement):
     ...     "default": b.eq(0),
     ... })
     """
+    __slots__ = ("test", "cases")
+
     def __init__(self, test, cases):
         self.test = wrap(test)
         self.cases = dict()
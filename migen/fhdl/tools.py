@@ -1,5 +1,9 @@
+import operator
+from collections import defaultdict
+
 from migen.fhdl.structure import *  # noqa
-from migen.fhdl.structure import _Slice, _Part, _Assign, _Fragment
+from migen.fhdl.structure import (_Operator, _Slice, _Part, _Assign,
+                                  _Fragment)
 from migen.fhdl.visit import NodeVisitor, NodeTransformer
 from migen.fhdl.bitcontainer import value_bits_sign
 from migen.util.misc import flat_iteration
@@ -27,6 +31,9 @@ class _TargetLister(NodeVisitor):
         self.visit(node.l)
         self.target_context = False
 
+    def visit_Part(self, node):
+        self.visit(node.value)
+
     def visit_ArrayProxy(self, node):
         for choice in node.choices:
             self.visit(choice)
@@ -35,13 +42,32 @@ class _TargetLister(NodeVisitor):
 class _InputLister(NodeVisitor):
     def __init__(self):
         self.output_list = set()
+        self.target_context = False
 
     def visit_Signal(self, node):
-        self.output_list.add(node)
+        if not self.target_context:
+            self.output_list.add(node)
 
     def visit_Assign(self, node):
+        # offsets and indices of targets are read
+        self.target_context = True
+        self.visit(node.l)
+        self.target_context = False
         self.visit(node.r)
 
+    def visit_Part(self, node):
+        self.visit(node.value)
+        target_context, self.target_context = self.target_context, False
+        self.visit(node.offset)
+        self.target_context = target_context
+
+    def visit_ArrayProxy(self, node):
+        for choice in node.choices:
+            self.visit(choice)
+        target_context, self.target_context = self.target_context, False
+        self.visit(node.key)
+        self.target_context = target_context
+
 
 def list_signals(node):
     lister = _SignalLister()
@@ -294,6 +320,231 @@ def lower_complex_parts(f):
     return _apply_lowerer(_ComplexPartLowerer(), f)
 
 
+_fold_operators = {
+    "~": operator.invert,
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    ">>>": operator.rshift,
+    "<<<": operator.lshift,
+    "&": operator.and_,
+    "^": operator.xor,
+    "|": operator.or_,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _fits(value, nbits, signed):
+    if signed:
+        return -2**(nbits - 1) <= value < 2**(nbits - 1)
+    else:
+        return 0 <= value < 2**nbits
+
+
+def _constant_value(node):
+    if isinstance(node, Constant) and _fits(node.value, node.nbits,
+                                            node.signed):
+        return node.value
+    return None
+
+
+class _ConstantFolder(_Lowerer):
+    """Evaluate expressions over constants and prune constant control flow
+
+    Expressions are only replaced by constants of their own width and
+    signedness, and only when the result fits, so that the design behaves
+    the same in the simulator and in the generated HDL. Expressions are
+    only replaced by one of their operands (e.g. `Mux` with a constant
+    select) when both have the same width and signedness, or when the
+    operand is a constant that can be given those. Zero-width expressions
+    are left as they are, since constants cannot represent them.
+    """
+    def _substitute(self, node, replacement):
+        bits_sign = value_bits_sign(node)
+        if value_bits_sign(replacement) == bits_sign:
+            return replacement
+        value = _constant_value(replacement)
+        if value is not None and _fits(value, *bits_sign):
+            return Constant(value, bits_sign)
+        return None
+
+    def visit_Operator(self, node):
+        operands = [self.visit(o) for o in node.operands]
+        r = _Operator(node.op, operands)
+        values = [_constant_value(o) for o in operands]
+        if node.op == "m":
+            if values[0] is not None:
+                choice = operands[1] if values[0] else operands[2]
+                choice = self._substitute(r, choice)
+                if choice is not None:
+                    return choice
+            return r
+        if any(v is None for v in values):
+            return r
+        if node.op == "-" and len(values) == 1:
+            value = -values[0]
+        elif node.op in ("<<<", ">>>") and values[1] < 0:
+            return r
+        else:
+            value = int(_fold_operators[node.op](*values))
+        bits_sign = value_bits_sign(r)
+        if not _fits(value, *bits_sign):
+            return r
+        return Constant(value, bits_sign)
+
+    def visit_Slice(self, node):
+        r = super().visit_Slice(node)
+        value = _constant_value(r.value)
+        if value is None:
+            return r
+        nbits = r.stop - r.start
+        if not nbits:
+            return r
+        return Constant((value >> r.start) & (2**nbits - 1), nbits)
+
+    def visit_Part(self, node):
+        r = super().visit_Part(node)
+        offset = _constant_value(r.offset)
+        if offset is not None and 0 <= offset \
+                and offset + r.width <= len(r.value):
+            return self.visit_Slice(_Slice(r.value, offset,
+                                           offset + r.width))
+        return r
+
+    def visit_Cat(self, node):
+        r = super().visit_Cat(node)
+        value = 0
+        shift = 0
+        for element in r.l:
+            element_value = _constant_value(element)
+            if element_value is None:
+                return r
+            nbits = len(element)
+            value |= (element_value & (2**nbits - 1)) << shift
+            shift += nbits
+        if not shift:
+            return r
+        return Constant(value, shift)
+
+    def visit_Replicate(self, node):
+        r = super().visit_Replicate(node)
+        value = _constant_value(r.v)
+        if value is None or not r.n:
+            return r
+        nbits = len(r.v)
+        value &= 2**nbits - 1
+        return Constant(sum(value << i * nbits for i in range(r.n)),
+                        nbits * r.n)
+
+    def visit_ArrayProxy(self, node):
+        r = super().visit_ArrayProxy(node)
+        key = _constant_value(r.key)
+        if key is None or key < 0:
+            return r
+        choice = r.choices[min(key, len(r.choices) - 1)]
+        if self.target_context:
+            return choice
+        choice = self._substitute(r, choice)
+        if choice is not None:
+            return choice
+        return r
+
+    def visit_If(self, node):
+        r = super().visit_If(node)
+        cond = _constant_value(r.cond)
+        if cond is not None:
+            return r.t if cond else r.f
+        if not r.t and not r.f:
+            return []
+        return r
+
+    def visit_Case(self, node):
+        r = super().visit_Case(node)
+        test = _constant_value(r.test)
+        if test is None:
+            return r
+        for k, statements in r.cases.items():
+            if isinstance(k, Constant) and k.value == test:
+                return statements
+        return r.cases.get("default", [])
+
+    def visit_statements(self, node):
+        r = []
+        for statement in node:
+            statement = self.visit(statement)
+            # pruned control flow leaves lists of statements
+            if isinstance(statement, list):
+                r += statement
+            else:
+                r.append(statement)
+        return r
+
+
+def fold_constants(f):
+    """Simplify the statements of `f` whose outcome is constant
+
+    Expressions over constants are evaluated, and `If`, `Case`, `Mux` and
+    `Array` accesses with constant conditions, tests, selects or keys are
+    replaced by the branch they take.
+    """
+    return _apply_lowerer(_ConstantFolder(), f)
+
+
+def remove_dead_logic(f, observed):
+    """Remove the statements of `f` that cannot affect `observed` signals
+
+    Statements are kept if they assign to an observed signal, to a signal
+    with attributes, to a signal read by kept statements or by specials,
+    or to no signal at all (e.g. memory writes). Clock and reset signals
+    of the clock domains are observed.
+    """
+    live = set(observed)
+    live |= list_special_ios(f, True, True, True)
+    for cd in f.clock_domains:
+        live.add(cd.clk)
+        if cd.rst is not None:
+            live.add(cd.rst)
+
+    statements = [(None, s) for s in flat_iteration(f.comb)]
+    for cd, sl in sorted(f.sync.items(), key=operator.itemgetter(0)):
+        statements += [(cd, s) for s in flat_iteration(sl)]
+    drivers = defaultdict(list)
+    pending = []
+    for n, (cd, statement) in enumerate(statements):
+        targets = list_targets(statement)
+        if not targets or any(target.attr for target in targets):
+            pending.append(n)
+        for target in targets:
+            drivers[target].append(n)
+    pending += [n for signal in live for n in drivers.get(signal, ())]
+
+    kept = set()
+    while pending:
+        n = pending.pop()
+        if n in kept:
+            continue
+        kept.add(n)
+        for signal in list_inputs(statements[n][1]):
+            if signal not in live:
+                live.add(signal)
+                pending += drivers.get(signal, ())
+
+    f.comb = []
+    f.sync = dict()
+    for n, (cd, statement) in enumerate(statements):
+        if n in kept:
+            if cd is None:
+                f.comb.append(statement)
+            else:
+                f.sync.setdefault(cd, []).append(statement)
+    return f
+
+
 class _ClockDomainRenamer(NodeVisitor):
     def __init__(self, old, new):
         self.old = old
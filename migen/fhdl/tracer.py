@@ -1,7 +1,10 @@
 import inspect
+import weakref
 from sys import version_info
 from opcode import opname
 from collections import defaultdict
+from functools import partial
+from itertools import count
 
 # All opcodes are 2 bytes in length in Python 3.6
 
@@ -32,8 +35,10 @@ _load_build_opcodes = {
 
 
 def get_var_name(frame):
-    code = frame.f_code
-    call_index = frame.f_lasti
+    return _get_var_name(frame.f_code, frame.f_lasti)
+
+
+def _decode_var_name(code, call_index):
     call_opc = opname[code.co_code[call_index]]
     if call_opc not in _call_opcodes:
         return None
@@ -55,6 +60,19 @@ def get_var_name(frame):
             return None
 
 
+_var_names = dict()
+
+
+def _get_var_name(code, lasti):
+    # the name only depends on the bytecode around the call
+    try:
+        return _var_names[(code, lasti)]
+    except KeyError:
+        name = _decode_var_name(code, lasti)
+        _var_names[(code, lasti)] = name
+        return name
+
+
 def remove_underscore(s):
     if len(s) > 2 and s[0] == "_" and s[1] != "_":
         s = s[1:]
@@ -80,61 +98,157 @@ def get_obj_var_name(override=None, default=None):
     return vn
 
 
-name_to_idx = defaultdict(int)
-classname_to_objs = dict()
-
-
-def index_id(l, obj):
-    for n, e in enumerate(l):
-        if id(e) == id(obj):
-            return n
-    raise ValueError
-
-
-def trace_back(varname=None):
-    l = []
-    frame = inspect.currentframe().f_back.f_back
-    while frame is not None:
-        if varname is None:
-            varname = get_var_name(frame)
-        if varname is not None:
-            varname = remove_underscore(varname)
-            l.insert(0, (varname, name_to_idx[varname]))
-            name_to_idx[varname] += 1
-
-        try:
-            obj = frame.f_locals["self"]
-        except KeyError:
-            obj = None
-        if hasattr(obj, "__del__"):
-            obj = None
-
-        if obj is None:
+# Objects are numbered per class name in the order they are first seen.
+# id(obj) -> (backtrace step, weak reference to obj, or obj itself when
+# it does not support weak references)
+_object_steps = dict()
+_class_counts = defaultdict(int)
+
+
+def _forget_object(key, ref):
+    # the id of a dead object can be reused by a new one
+    if _object_steps.get(key, (None, None))[1] is ref:
+        del _object_steps[key]
+
+
+_self_codes = dict()
+
+
+def _may_have_self(code):
+    # Reading f_locals copies all local variables, so only do it for
+    # frames that can have a "self".
+    try:
+        return _self_codes[code]
+    except KeyError:
+        r = (not code.co_flags & inspect.CO_OPTIMIZED
+             or "self" in code.co_varnames
+             or "self" in code.co_cellvars
+             or "self" in code.co_freevars)
+        _self_codes[code] = r
+        return r
+
+
+def _object_index(obj):
+    key = id(obj)
+    try:
+        return _object_steps[key][0]
+    except KeyError:
+        pass
+    classname = obj.__class__.__name__.lower()
+    step = remove_underscore(classname), _class_counts[classname]
+    _class_counts[classname] += 1
+    try:
+        ref = weakref.ref(obj, partial(_forget_object, key))
+    except TypeError:
+        ref = obj
+    _object_steps[key] = step, ref
+    return step
+
+
+def object_step(obj):
+    """Return the backtrace step of `obj`, or None if it is not in any"""
+    try:
+        step, ref = _object_steps[id(obj)]
+    except KeyError:
+        return None
+    if ref is not obj and (not isinstance(ref, weakref.ref)
+                           or ref() is not obj):
+        return None
+    return step
+
+
+# Tells whether `capture` walks the stack. Without it, backtraces only
+# contain the explicit name of the object (which is enough for
+# simulation, but leads to poor names in generated code).
+enabled = True
+
+_sequence = count()
+# bound on the number of names in one backtrace
+_steps_per_trace = 1 << 20
+
+
+class Backtrace:
+    """Raw stack information from which a backtrace is built on demand
+
+    Only the code objects and positions of the frames are recorded, along
+    with the class and index of the objects whose methods they run. The
+    names are decoded when the backtrace is first needed, which is usually
+    never during simulation.
+
+    Names are numbered as if they had been counted by a global counter
+    when the trace was taken: by the sequence number of the trace, then by
+    their position in it. Numbers are only compared by the namer, so the
+    names do not depend on which backtraces are built, or in what order.
+    """
+    __slots__ = ("varname", "frames", "sequence")
+
+    def __init__(self, varname, frames, sequence):
+        self.varname = varname
+        self.frames = frames
+        self.sequence = sequence
+
+    def build(self):
+        l = []
+        varname = self.varname
+        n = self.sequence * _steps_per_trace
+        for code, lasti, module, obj_step in self.frames:
+            if varname is None:
+                varname = _get_var_name(code, lasti)
             if varname is not None:
-                coname = frame.f_code.co_name
-                if coname == "<module>":
-                    modules = frame.f_globals["__name__"]
-                    modules = modules.split(".")
-                    coname = modules[len(modules) - 1]
-                coname = remove_underscore(coname)
-                l.insert(0, (coname, name_to_idx[coname]))
-                name_to_idx[coname] += 1
-        else:
-            classname = obj.__class__.__name__.lower()
-            try:
-                objs = classname_to_objs[classname]
-            except KeyError:
-                classname_to_objs[classname] = [obj]
-                idx = 0
+                varname = remove_underscore(varname)
+                l.append((varname, n))
+                n += 1
+            if obj_step is None:
+                if varname is not None:
+                    coname = code.co_name
+                    if module is not None:
+                        coname = module.split(".")[-1]
+                    coname = remove_underscore(coname)
+                    l.append((coname, n))
+                    n += 1
             else:
-                try:
-                    idx = index_id(objs, obj)
-                except ValueError:
-                    idx = len(objs)
-                    objs.append(obj)
-            classname = remove_underscore(classname)
-            l.insert(0, (classname, idx))
-
-        varname = None
+                l.append(obj_step)
+            varname = None
+        l.reverse()
+        return l
+
+    def __reduce__(self):
+        # code objects cannot be pickled
+        return list, (self.build(), )
+
+
+def capture(varname=None, depth=2):
+    """Record the stack of the caller's caller as a `Backtrace`
+
+    If tracing is disabled, the backtrace is built immediately from
+    `varname` alone.
+    """
+    sequence = next(_sequence)
+    if not enabled:
+        return [(varname or "anonymous", sequence)]
+    frames = []
+    frame = inspect.currentframe()
+    for i in range(depth):
+        frame = frame.f_back
+    self_codes = _self_codes
+    while frame is not None:
+        code = frame.f_code
+        module = obj_step = None
+        if code.co_name == "<module>":
+            module = frame.f_globals["__name__"]
+        if self_codes.get(code, True) and _may_have_self(code):
+            obj = frame.f_locals.get("self")
+            if obj is not None and not hasattr(obj, "__del__"):
+                obj_step = _object_index(obj)
+        frames.append((code, frame.f_lasti, module, obj_step))
         frame = frame.f_back
-    return l
+    return Backtrace(varname, frames, sequence)
+
+
+def trace_back(varname=None):
+    """Return the backtrace of the caller's caller
+
+    Each step is a name and a number, from the outermost frame to the
+    innermost one.
+    """
+    return capture(varname, 3).build()
@@ -318,10 +318,15 @@ def convert(fi, ios=None, name="top",
             special_overrides=dict(),
             attr_translate=DummyAttrTranslate(),
             create_clock_domains=True,
-            display_run=False):
+            display_run=False, simplify=False, names=None):
     r = ConvOutput()
     f = _Fragment()
-    if not isinstance(fi, _Fragment):
+    if isinstance(fi, _Fragment):
+        if names is not None:
+            raise ValueError("Names can only be kept for modules")
+        top = None
+    else:
+        top = fi
         fi = fi.get_fragment()
     f += fi
     if ios is None:
@@ -343,6 +348,9 @@ def convert(fi, ios=None, name="top",
                 raise KeyError("Unresolved clock domain: '{}'".format(cd_name))
 
     f = lower_complex_slices(f)
+    if simplify:
+        f = fold_constants(f)
+        remove_dead_logic(f, ios)
     insert_resets(f)
     f = lower_basics(f)
     fs, lowered_specials = lower_specials(special_overrides, f.specials)
@@ -355,7 +363,7 @@ def convert(fi, ios=None, name="top",
                 io.name_override = io_name
     ns = build_namespace(
         list_signals(f) | list_special_ios(f, True, True, True) | ios,
-        _reserved_keywords)
+        _reserved_keywords, names, top)
     ns.clock_domains = f.clock_domains
     r.ns = ns
 
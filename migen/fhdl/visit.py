@@ -20,6 +20,8 @@ class NodeVisitor:
             self.visit_Operator(node)
         elif isinstance(node, _Slice):
             self.visit_Slice(node)
+        elif isinstance(node, _Part):
+            self.visit_Part(node)
         elif isinstance(node, Cat):
             self.visit_Cat(node)
         elif isinstance(node, Replicate):
@@ -1 +1,2 @@
-from migen.sim.core import Simulator, run_simulation, passive
+from migen.sim.core import (Simulator, run_simulation, passive,
+                            WaitCycles, WaitUntil, WaitChange, Yield)
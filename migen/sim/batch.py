@@ -0,0 +1,302 @@
+import collections
+
+import numpy as np
+
+from migen.fhdl.structure import *  # noqa
+from migen.fhdl.structure import (_Value, _Operator, _Slice, _Part,
+                                  _ArrayProxy, _Assign)
+from migen.fhdl.bitcontainer import value_bits_sign
+from migen.fhdl.specials import _MemoryLocation
+from migen.fhdl.visit import NodeVisitor
+from migen.sim.core import Simulator, Evaluator, str2op
+
+
+__all__ = ["Lanes", "BatchSimulator", "run_batch_simulation"]
+
+
+# Lane values are stored in int64 arrays. Wrapping arithmetic keeps the
+# low 64 bits exact, so anything up to 63 bits (plus sign) is safe.
+_MAX_BITS = 63
+
+_comparisons = {"<", "<=", "==", "!=", ">", ">="}
+
+
+class Lanes(_Value):
+    """Per-lane values for statements issued by batch testbenches
+
+    ``yield signal.eq(Lanes(values))`` assigns ``values[i]`` to the
+    signal in lane ``i``.
+    """
+    def __init__(self, values):
+        super().__init__()
+        self.values = np.asarray(values, dtype=np.int64)
+
+
+def _truncate(value, nbits, signed):
+    value = value & (2**nbits - 1)
+    if signed:
+        sign = 2**(nbits - 1)
+        value = (value ^ sign) - sign
+    return value
+
+
+class _WidthChecker(NodeVisitor):
+    def _check(self, node):
+        nbits = value_bits_sign(node)[0]
+        if nbits > _MAX_BITS:
+            raise ValueError("{} is {} bits wide, batch simulation supports"
+                             " at most {}".format(node, nbits, _MAX_BITS))
+
+    def visit_Signal(self, node):
+        self._check(node)
+
+    def visit_Operator(self, node):
+        self._check(node)
+        super().visit_Operator(node)
+
+    def visit_Cat(self, node):
+        self._check(node)
+        super().visit_Cat(node)
+
+    def visit_Replicate(self, node):
+        self._check(node)
+        super().visit_Replicate(node)
+
+    def visit_unknown(self, node):
+        if isinstance(node, _MemoryLocation):
+            if node.memory.width > _MAX_BITS:
+                raise ValueError("Memory {} is {} bits wide, batch simulation"
+                                 " supports at most {}".format(
+                                     node.memory, node.memory.width,
+                                     _MAX_BITS))
+            self.visit(node.index)
+
+
+class BatchEvaluator(Evaluator):
+    """Evaluator running `lanes` independent copies of a design
+
+    Every slot holds an int64 array with one value per lane. Control flow
+    is turned into lane masks: statements are executed once for all lanes
+    and assignments only take effect in the lanes whose conditions hold.
+    Arrays stored in slots are never modified in place.
+    """
+    def __init__(self, clock_domains, lanes, memories=()):
+        self.lanes = lanes
+        self._lane_index = np.arange(lanes)
+        super().__init__(clock_domains, memories)
+
+    def _broadcast(self, value):
+        return np.broadcast_to(np.asarray(value, dtype=np.int64),
+                               (self.lanes, ))
+
+    def _add_slot(self, signal, value):
+        return super()._add_slot(signal, self._broadcast(value))
+
+    def is_true(self, value):
+        # conditions must hold in all lanes
+        return bool(np.all(value))
+
+    def differs(self, value, reference):
+        # a change in any lane counts
+        return bool(np.any(value != reference))
+
+    def get_memory(self, memory):
+        try:
+            return self.memories[memory]
+        except KeyError:
+            state = super().get_memory(memory)
+            # one column per lane, writes are (index, enable, value)
+            state.data = np.tile(np.array(state.data, dtype=np.int64)[:, None],
+                                 (1, self.lanes))
+            state.pending = []
+            return state
+
+    def commit(self):
+        values, next_values = self.values, self.next_values
+        r = []
+        for k in set(self.dirty):
+            v = next_values[k]
+            if not np.array_equal(values[k], v):
+                values[k] = v
+                r.append(k)
+        self.dirty.clear()
+        for memory in self.dirty_memories:
+            data = memory.data
+            changed = False
+            for index, enable, value in memory.pending:
+                lanes = np.flatnonzero(enable)
+                index = index[lanes]
+                value = value[lanes]
+                if not np.array_equal(data[index, lanes], value):
+                    data[index, lanes] = value
+                    changed = True
+            memory.pending.clear()
+            if changed:
+                k = memory.slot
+                values[k] = next_values[k] = values[k] + 1
+                r.append(k)
+        self.dirty_memories.clear()
+        return r
+
+    def eval(self, node, postcommit=False):  # noqa
+        if isinstance(node, _Operator):
+            operands = [self.eval(o, postcommit) for o in node.operands]
+            if node.op == "-" and len(operands) == 1:
+                return -operands[0]
+            elif node.op == "m":
+                return np.where(operands[0], operands[1], operands[2])
+            r = str2op[node.op](*operands)
+            if node.op in _comparisons:
+                r = np.asarray(r, dtype=np.int64)
+            return r
+        elif isinstance(node, _Slice):
+            v = self.eval(node.value, postcommit)
+            return (v >> node.start) & (2**(node.stop - node.start) - 1)
+        elif isinstance(node, _Part):
+            v = self.eval(node.value, postcommit)
+            offset = self.eval(node.offset, postcommit)
+            return (v >> offset) & (2**node.width - 1)
+        elif isinstance(node, _ArrayProxy):
+            index = np.minimum(len(node.choices) - 1,
+                               self.eval(node.key, postcommit))
+            r = self.eval(node.choices[0], postcommit)
+            for n, choice in enumerate(node.choices[1:], 1):
+                r = np.where(index == n, self.eval(choice, postcommit), r)
+            return r
+        elif isinstance(node, _MemoryLocation):
+            memory = self.get_memory(node.memory)
+            index = self._broadcast(self.eval(node.index, postcommit))
+            r = memory.data[index, self._lane_index]
+            if postcommit:
+                for windex, enable, value in memory.pending:
+                    r = np.where(enable & (windex == index), value, r)
+            return r
+        elif isinstance(node, Lanes):
+            if node.values.shape != (self.lanes, ):
+                raise ValueError("Expected {} lane values, got shape {}"
+                                 .format(self.lanes, node.values.shape))
+            return node.values
+        else:
+            return super().eval(node, postcommit)
+
+    def assign(self, node, value, enable=None):  # noqa
+        if isinstance(node, Signal):
+            assert not node.variable
+            slot = self.get_slot(node)
+            value = _truncate(value, node.nbits, node.signed)
+            if enable is not None:
+                value = np.where(enable, value, self.next_values[slot])
+            self.next_values[slot] = self._broadcast(value)
+            self.dirty.append(slot)
+        elif isinstance(node, Cat):
+            for element in node.l:
+                nbits = len(element)
+                self.assign(element, value & (2**nbits - 1), enable)
+                value = value >> nbits
+        elif isinstance(node, _Slice):
+            full_value = self.eval(node.value, True)
+            full_value = full_value & ~((2**node.stop - 1)
+                                        - (2**node.start - 1))
+            value = value & (2**(node.stop - node.start) - 1)
+            full_value = full_value | (value << node.start)
+            self.assign(node.value, full_value, enable)
+        elif isinstance(node, _Part):
+            full_value = self.eval(node.value, True)
+            offset = self.eval(node.offset, True)
+            mask = 2**node.width - 1
+            full_value = ((full_value & ~(mask << offset))
+                          | ((value & mask) << offset))
+            self.assign(node.value, full_value, enable)
+        elif isinstance(node, _ArrayProxy):
+            index = np.minimum(len(node.choices) - 1, self.eval(node.key))
+            for n, choice in enumerate(node.choices):
+                selected = index == n
+                if enable is not None:
+                    selected = selected & enable
+                if np.any(selected):
+                    self.assign(choice, value, selected)
+        elif isinstance(node, _MemoryLocation):
+            memory = self.get_memory(node.memory)
+            index = self._broadcast(self.eval(node.index))
+            if enable is None:
+                enable = np.ones(self.lanes, dtype=bool)
+            bad = enable & ((index < 0) | (index >= len(memory.data)))
+            if np.any(bad):
+                raise IndexError("Address {} out of range for memory {}"
+                                 .format(index[bad][0],
+                                         node.memory.name_override))
+            memory.pending.append((index, self._broadcast(enable),
+                                   self._broadcast(value & memory.mask)))
+            self.dirty_memories.append(memory)
+        else:
+            raise NotImplementedError(node)
+
+    def _execute_masked(self, statements, enable, mask):
+        if enable is not None:
+            mask = mask & enable
+        if np.any(mask):
+            self.execute(statements, mask)
+
+    def execute(self, statements, enable=None):
+        for s in statements:
+            if isinstance(s, _Assign):
+                self.assign(s.l, self.eval(s.r), enable)
+            elif isinstance(s, If):
+                cond = np.asarray(self.eval(s.cond) & (2**len(s.cond) - 1)) != 0
+                self._execute_masked(s.t, enable, cond)
+                self._execute_masked(s.f, enable, ~cond)
+            elif isinstance(s, Case):
+                nbits, signed = value_bits_sign(s.test)
+                test = _truncate(self.eval(s.test), nbits, signed)
+                if enable is None:
+                    remaining = np.ones(self.lanes, dtype=bool)
+                else:
+                    remaining = enable
+                for k, v in s.cases.items():
+                    if isinstance(k, Constant):
+                        match = remaining & (test == k.value)
+                        if np.any(match):
+                            self.execute(v, match)
+                            remaining = remaining & ~match
+                if "default" in s.cases and np.any(remaining):
+                    self.execute(s.cases["default"], remaining)
+            elif isinstance(s, collections.Iterable):
+                self.execute(s, enable)
+            else:
+                raise NotImplementedError
+
+
+class BatchSimulator(Simulator):
+    """Simulate `lanes` copies of a design in lockstep
+
+    All copies share the clocks and the generators, but each has its own
+    state. Generators read arrays with one value per lane (``yield
+    signal``) and write either the same value to all lanes (``yield
+    signal.eq(value)``) or one value per lane (``yield
+    signal.eq(Lanes(values))``).
+
+    The FHDL statements are interpreted with NumPy operations over all
+    lanes at once, so the interpretation overhead is shared by the lanes.
+    Signals and expressions are limited to 63 bits.
+
+    `WaitUntil` resumes a generator once its condition holds in all
+    lanes, `WaitChange` once its expression has changed in any lane.
+    """
+    def __init__(self, fragment_or_module, generators, lanes,
+                 clocks={"sys": 10}, special_overrides={}):
+        self.lanes = lanes
+        super().__init__(fragment_or_module, generators, clocks,
+                         special_overrides=special_overrides, compiled=False)
+
+    def _create_evaluator(self, memories):
+        checker = _WidthChecker()
+        checker.visit(self.fragment.comb)
+        for statements in self.fragment.sync.values():
+            checker.visit(statements)
+        return BatchEvaluator(self.fragment.clock_domains, self.lanes,
+                              memories)
+
+
+def run_batch_simulation(*args, **kwargs):
+    with BatchSimulator(*args, **kwargs) as s:
+        s.run()
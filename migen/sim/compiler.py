@@ -0,0 +1,375 @@
+from migen.fhdl.structure import *  # noqa
+from migen.fhdl.structure import (_Operator, _Slice, _Part, _ArrayProxy,
+                                  _Assign)
+from migen.fhdl.bitcontainer import value_bits_sign
+from migen.fhdl.specials import _MemoryLocation
+
+
+_binop2py = {
+    "+": "+",
+    "-": "-",
+    "*": "*",
+
+    ">>>": ">>",
+    "<<<": "<<",
+
+    "&": "&",
+    "^": "^",
+    "|": "|",
+
+    "<": "<",
+    "<=": "<=",
+    "==": "==",
+    "!=": "!=",
+    ">": ">",
+    ">=": ">=",
+}
+
+
+# Case statements with at least this many values are compiled into a
+# dictionary of functions, smaller ones into if/elif chains.
+_CASE_TABLE_MIN = 8
+
+
+def _mask(nbits):
+    return (1 << nbits) - 1
+
+
+def case_table(case):
+    """Map the test values of a `Case` to the statements they select
+
+    Returns the dictionary and the default statements (or None). Like
+    the sequential comparison, the first case listed for a value wins.
+    """
+    table = dict()
+    for k, v in case.cases.items():
+        if isinstance(k, Constant):
+            table.setdefault(k.value, v)
+    return table, case.cases.get("default")
+
+
+class StatementCompiler:
+    """Translate FHDL statements into Python functions
+
+    The generated code works on the state of the given `Evaluator` and
+    mirrors the semantics of `Evaluator.execute`, but the tree walk and
+    the type dispatch are done once, at compile time.
+    """
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+
+    def compile(self, statements, name="run"):
+        """Compile a statement list into a function without arguments"""
+        self._env = {
+            "cur": self.evaluator.values,
+            "nxt": self.evaluator.next_values,
+            "d": self.evaluator.dirty.append,
+        }
+        self._names = dict()
+        self._ntemps = 0
+        self._lines = []
+        self._helpers = []
+
+        self._statements(statements, 1)
+        body = self._lines or ["\tpass"]
+        src = "\n".join(self._helpers + [
+            "def {}(cur=cur, nxt=nxt, d=d):".format(name)] + body) + "\n"
+        try:
+            code = compile(src, "<migen-sim:{}>".format(name), "exec")
+        except RecursionError:
+            # pathologically deep trees: fall back to interpretation
+            execute = self.evaluator.execute
+            return lambda: execute(statements)
+        exec(code, self._env)
+        return self._env[name]
+
+    def _bind(self, obj, prefix, value=None):
+        try:
+            return self._names[id(obj)]
+        except KeyError:
+            name = "_{}{}".format(prefix, len(self._names))
+            self._names[id(obj)] = name
+            self._env[name] = obj if value is None else value
+            return name
+
+    def _signal(self, signal):
+        return str(self.evaluator.get_slot(signal))
+
+    def _table_slot(self, signals, index):
+        slots = [self.evaluator.get_slot(s) for s in signals]
+        if slots == list(range(slots[0], slots[0] + len(slots))):
+            return "{} + {}".format(slots[0], index)
+        return "{}[{}]".format(self._bind(signals, "a", tuple(slots)), index)
+
+    def _temp(self):
+        self._ntemps += 1
+        return "_t{}".format(self._ntemps)
+
+    def _emit(self, indent, line):
+        self._lines.append("\t" * indent + line)
+
+    # expressions
+
+    def _expr(self, node, postcommit=False):  # noqa
+        if isinstance(node, Constant):
+            return "({})".format(node.value)
+        elif isinstance(node, Signal):
+            if postcommit:
+                return "nxt[{}]".format(self._signal(node))
+            return "cur[{}]".format(self._signal(node))
+        elif isinstance(node, _Operator):
+            operands = [self._expr(o, postcommit) for o in node.operands]
+            if node.op == "~":
+                return "(~{})".format(operands[0])
+            elif node.op == "-" and len(operands) == 1:
+                return "(-{})".format(operands[0])
+            elif node.op == "m":
+                return "({1} if {0} else {2})".format(*operands)
+            else:
+                return "({} {} {})".format(operands[0], _binop2py[node.op],
+                                           operands[1])
+        elif isinstance(node, _Slice):
+            v = self._expr(node.value, postcommit)
+            return "(({} >> {}) & {})".format(
+                v, node.start, _mask(node.stop - node.start))
+        elif isinstance(node, _Part):
+            v = self._expr(node.value, postcommit)
+            offset = self._expr(node.offset, postcommit)
+            return "(({} >> {}) & {})".format(v, offset, _mask(node.width))
+        elif isinstance(node, Cat):
+            terms = []
+            shift = 0
+            for element in node.l:
+                nbits = len(element)
+                term = "({} & {})".format(self._expr(element, postcommit),
+                                          _mask(nbits))
+                if shift:
+                    term = "({} << {})".format(term, shift)
+                terms.append(term)
+                shift += nbits
+            if not terms:
+                return "(0)"
+            return "({})".format(" | ".join(terms))
+        elif isinstance(node, Replicate):
+            nbits = len(node.v)
+            unit = sum(1 << i * nbits for i in range(node.n))
+            return "(({} & {}) * {})".format(
+                self._expr(node.v, postcommit), _mask(nbits), unit)
+        elif isinstance(node, _ArrayProxy):
+            return self._choice_expr(node.choices, node.key, postcommit)
+        elif isinstance(node, _MemoryLocation):
+            memory = self.evaluator.get_memory(node.memory)
+            data = self._bind(memory.data, "m")
+            index = self._expr(node.index, postcommit)
+            if postcommit:
+                pending = self._bind(memory.pending, "p")
+                return "{0}.get({2}, {1}[{2}])".format(pending, data, index)
+            return "{}[{}]".format(data, index)
+        elif isinstance(node, ClockSignal):
+            return self._expr(
+                self.evaluator.clock_domains[node.cd].clk, postcommit)
+        elif isinstance(node, ResetSignal):
+            rst = self.evaluator.clock_domains[node.cd].rst
+            if rst is None:
+                if node.allow_reset_less:
+                    return "(0)"
+                else:
+                    raise ValueError(
+                        "Attempted to get reset signal of resetless"
+                        " domain '{}'".format(node.cd))
+            return self._expr(rst, postcommit)
+        else:
+            raise NotImplementedError(node)
+
+    def _index_expr(self, choices, key, postcommit=False):
+        return "min({}, {})".format(len(choices) - 1,
+                                    self._expr(key, postcommit))
+
+    def _choice_expr(self, choices, key, postcommit):
+        index = self._index_expr(choices, key, postcommit)
+        if all(isinstance(c, Signal) for c in choices):
+            return "{}[{}]".format("nxt" if postcommit else "cur",
+                                   self._table_slot(choices, index))
+        # generic choices are evaluated lazily through helper functions
+        # (compiled first, as nested choices register their own helpers)
+        lambdas = ", ".join("lambda cur=cur, nxt=nxt: {}".format(
+            self._expr(c, postcommit)) for c in choices)
+        table = "_f{}".format(len(self._helpers))
+        self._helpers.append("{} = ({},)".format(table, lambdas))
+        return "{}[{}]()".format(table, index)
+
+    # assignments
+
+    def _assign(self, node, value, indent):  # noqa
+        if isinstance(node, Signal):
+            assert not node.variable
+            self._store(self._signal(node), node.nbits, node.signed,
+                        value, indent)
+        elif isinstance(node, Cat):
+            t = self._temp()
+            self._emit(indent, "{} = {}".format(t, value))
+            shift = 0
+            for element in node.l:
+                nbits = len(element)
+                self._assign(element, "(({} >> {}) & {})".format(
+                    t, shift, _mask(nbits)), indent)
+                shift += nbits
+        elif isinstance(node, _Slice):
+            t = self._temp()
+            clear = _mask(node.stop) - _mask(node.start)
+            self._emit(indent, "{} = ({} & {}) | (({} & {}) << {})".format(
+                t, self._expr(node.value, True), ~clear, value,
+                _mask(node.stop - node.start), node.start))
+            self._assign(node.value, t, indent)
+        elif isinstance(node, _Part):
+            t, o = self._temp(), self._temp()
+            mask = _mask(node.width)
+            self._emit(indent, "{} = {}".format(
+                o, self._expr(node.offset, True)))
+            self._emit(indent,
+                       "{0} = ({1} & ~({2} << {3})) | (({4} & {2}) << {3})"
+                       .format(t, self._expr(node.value, True), mask, o,
+                               value))
+            self._assign(node.value, t, indent)
+        elif isinstance(node, _ArrayProxy):
+            self._choice_assign(node.choices, node.key, value, indent)
+        elif isinstance(node, _MemoryLocation):
+            memory = self.evaluator.get_memory(node.memory)
+            i = self._temp()
+            self._emit(indent, "{} = {}".format(i, self._expr(node.index)))
+            self._emit(indent, "if not 0 <= {} < {}:".format(
+                i, len(memory.data)))
+            self._emit(indent + 1, "raise IndexError({!r}.format({}))".format(
+                "Address {{}} out of range for memory {}".format(
+                    node.memory.name_override), i))
+            self._emit(indent, "{}[{}] = {} & {}".format(
+                self._bind(memory.pending, "p"), i, value, memory.mask))
+            self._emit(indent, "{}({})".format(
+                self._bind(self.evaluator.dirty_memories, "dm",
+                           self.evaluator.dirty_memories.append),
+                self._bind(memory, "ms")))
+        else:
+            raise NotImplementedError(node)
+
+    def _store(self, slot, nbits, signed, value, indent):
+        if not slot.isdigit():
+            t = self._temp()
+            self._emit(indent, "{} = {}".format(t, slot))
+            slot = t
+        if signed:
+            t = self._temp()
+            self._emit(indent, "{} = {} & {}".format(t, value, _mask(nbits)))
+            self._emit(indent, "nxt[{}] = {} - {} if {} & {} else {}".format(
+                slot, t, 1 << nbits, t, 1 << (nbits - 1), t))
+        else:
+            self._emit(indent, "nxt[{}] = {} & {}".format(
+                slot, value, _mask(nbits)))
+        self._emit(indent, "d({})".format(slot))
+
+    def _choice_assign(self, choices, key, value, indent):
+        index = self._index_expr(choices, key)
+        shapes = {(c.nbits, c.signed) if isinstance(c, Signal) else None
+                  for c in choices}
+        if len(shapes) == 1 and None not in shapes:
+            # uniform tables of signals
+            nbits, signed = shapes.pop()
+            self._store(self._table_slot(choices, index), nbits, signed,
+                        value, indent)
+            return
+        t, i = self._temp(), self._temp()
+        self._emit(indent, "{} = {}".format(t, value))
+        self._emit(indent, "{} = {}".format(i, index))
+        for n, choice in enumerate(choices):
+            self._emit(indent, "{} {} == {}:".format(
+                "if" if n == 0 else "elif", i, n))
+            self._assign(choice, t, indent + 1)
+
+    # statements
+
+    def _statements(self, statements, indent):  # noqa
+        for s in statements:
+            if isinstance(s, _Assign):
+                self._assign(s.l, self._expr(s.r), indent)
+            elif isinstance(s, If):
+                self._if(s, indent, "if")
+            elif isinstance(s, Case):
+                self._case(s, indent)
+            elif isinstance(s, (list, tuple)):
+                self._statements(s, indent)
+            else:
+                raise NotImplementedError(s)
+
+    def _block(self, statements, indent):
+        n = len(self._lines)
+        self._statements(statements, indent)
+        if len(self._lines) == n:
+            self._emit(indent, "pass")
+
+    def _if(self, s, indent, keyword):
+        self._emit(indent, "{} {} & {}:".format(
+            keyword, self._expr(s.cond), _mask(len(s.cond))))
+        self._block(s.t, indent + 1)
+        if len(s.f) == 1 and isinstance(s.f[0], If):
+            # keep Elif chains flat
+            self._if(s.f[0], indent, "elif")
+        elif s.f:
+            self._emit(indent, "else:")
+            self._block(s.f, indent + 1)
+
+    def _case(self, s, indent):
+        nbits, signed = value_bits_sign(s.test)
+        t = self._temp()
+        self._emit(indent, "{} = {} & {}".format(
+            t, self._expr(s.test), _mask(nbits)))
+        if signed:
+            self._emit(indent, "if {} & {}:".format(t, 1 << (nbits - 1)))
+            self._emit(indent + 1, "{} -= {}".format(t, 1 << nbits))
+        table, default = case_table(s)
+        if len(table) >= _CASE_TABLE_MIN:
+            self._case_dispatch(t, table, default, indent)
+            return
+        keyword = "if"
+        for k, v in s.cases.items():
+            if isinstance(k, Constant):
+                self._emit(indent, "{} {} == {}:".format(keyword, t, k.value))
+                self._block(v, indent + 1)
+                keyword = "elif"
+        if "default" in s.cases:
+            if keyword == "if":
+                self._block(s.cases["default"], indent)
+            else:
+                self._emit(indent, "else:")
+                self._block(s.cases["default"], indent + 1)
+
+    def _function(self, statements):
+        # compile statements into a module level function sharing the
+        # state of the main one
+        n = len(self._helpers)
+        name = "_c{}".format(n)
+        # reserve the name, nested cases add their own functions
+        self._helpers.append(None)
+        lines, self._lines = self._lines, []
+        self._block(statements, 1)
+        body, self._lines = self._lines, lines
+        self._helpers[n] = "\n".join(
+            ["def {}(cur=cur, nxt=nxt, d=d):".format(name)] + body)
+        return name
+
+    def _case_dispatch(self, t, table, default, indent):
+        functions = dict()
+        entries = []
+        for value, statements in table.items():
+            if id(statements) not in functions:
+                functions[id(statements)] = self._function(statements)
+            entries.append("{}: {}".format(value, functions[id(statements)]))
+        name = "_k{}".format(len(self._helpers))
+        self._helpers.append("{} = {{{}}}.get".format(name,
+                                                      ", ".join(entries)))
+        if default is None:
+            f = self._temp()
+            self._emit(indent, "{} = {}({})".format(f, name, t))
+            self._emit(indent, "if {} is not None:".format(f))
+            self._emit(indent + 1, "{}()".format(f))
+        else:
+            self._emit(indent, "{}({}, {})()".format(
+                name, t, self._function(default)))
@@ -1,32 +1,42 @@
 import operator
+import asyncio
 import collections
+import heapq
 import inspect
-from functools import wraps
+import logging
+import pickle
+from functools import wraps, partial
 
 from migen.fhdl.structure import *  # noqa
 from migen.fhdl.structure import (_Value, _Statement,
                                   _Operator, _Slice, _Part, _ArrayProxy,
                                   _Assign, _Fragment)
 from migen.fhdl.bitcontainer import value_bits_sign
-from migen.fhdl.tools import (list_targets, list_signals,
-                              insert_resets, lower_specials)
-from migen.fhdl.simplify import MemoryToArray
-from migen.fhdl.specials import _MemoryLocation
+from migen.fhdl.tools import (list_targets, list_signals, group_by_targets,
+                              insert_resets, lower_specials, fold_constants,
+                              remove_dead_logic, _InputLister)
+from migen.fhdl.namer import build_namespace
+from migen.fhdl.specials import (Memory, _MemoryLocation, Instance,
+                                 WRITE_FIRST, NO_CHANGE)
 from migen.fhdl.module import Module
+from migen.fhdl.decorators import ModuleTransformer
 from migen.genlib.resetsync import AsyncResetSynchronizer
 from migen.sim.vcd import VCDWriter, DummyVCDWriter
+from migen.sim.compiler import StatementCompiler, case_table
+from migen.sim.profile import Profiler, _statements_source
 
 
 class ClockState:
-    def __init__(self, high, half_period, time_before_trans):
+    def __init__(self, high, half_period, next_transition):
         self.high = high
         self.half_period = half_period
-        self.time_before_trans = time_before_trans
+        self.next_transition = next_transition
 
 
 class TimeManager:
     def __init__(self, description):
         self.clocks = collections.OrderedDict()
+        self.now = 0
 
         for k, period_phase in description.items():
             if isinstance(period_phase, tuple):
@@ -41,22 +51,57 @@ class TimeManager:
             else:
                 high = False
             self.clocks[k] = ClockState(high, half_period, half_period - phase)
+        self.reschedule()
+
+    def reschedule(self):
+        """Rebuild the queue of transitions after changing clock states"""
+        # the index breaks ties in the order of the clocks
+        self.transitions = [(cs.next_transition, n, k) for n, (k, cs)
+                            in enumerate(self.clocks.items())]
+        heapq.heapify(self.transitions)
 
     def tick(self):
         rising = set()
         falling = set()
-        dt = min(cs.time_before_trans for cs in self.clocks.values())
+        transitions = self.transitions
+        t = transitions[0][0]
+        while transitions[0][0] == t:
+            _, n, k = transitions[0]
+            cs = self.clocks[k]
+            cs.high = not cs.high
+            if cs.high:
+                rising.add(k)
+            else:
+                falling.add(k)
+            cs.next_transition = t + cs.half_period
+            heapq.heapreplace(transitions, (cs.next_transition, n, k))
+        dt = t - self.now
+        self.now = t
+        return dt, rising, falling
+
+    def rising_edge_time(self, k, n):
+        """Time of the `n`-th next rising edge of clock `k`"""
+        cs = self.clocks[k]
+        first = cs.next_transition
+        if cs.high:
+            first += cs.half_period
+        return first + (n - 1) * 2 * cs.half_period
+
+    def skip(self, until):
+        """Apply all transitions before time `until` without reporting them
+
+        Returns the number of skipped rising edges of each clock.
+        """
+        skipped = dict()
         for k, cs in self.clocks.items():
-            if cs.time_before_trans == dt:
+            n = max(0, -(-(until - cs.next_transition) // cs.half_period))
+            # transitions alternate, starting with a rising one if low
+            skipped[k] = (n + (not cs.high)) // 2
+            if n % 2:
                 cs.high = not cs.high
-                if cs.high:
-                    rising.add(k)
-                else:
-                    falling.add(k)
-            cs.time_before_trans -= dt
-            if not cs.time_before_trans:
-                cs.time_before_trans += cs.half_period
-        return dt, rising, falling
+            cs.next_transition += n * cs.half_period
+        self.reschedule()
+        return skipped
 
 
 str2op = {
@@ -82,26 +127,112 @@ str2op = {
 
 
 def _truncate(value, nbits, signed):
-    value = value & (2 ** nbits - 1)
-    if signed and (value & 2 ** (nbits - 1)):
-        value -= 2 ** nbits
+    value = value & ((1 << nbits) - 1)
+    if signed and (value >> (nbits - 1)) & 1:
+        value -= 1 << nbits
     return value
 
 
+def _replicate_unit(nbits, n):
+    """Multiplier placing `n` copies of an `nbits` wide value side by side"""
+    if not nbits:
+        return 0
+    return ((1 << nbits * n) - 1) // ((1 << nbits) - 1)
+
+
+class MemoryState:
+    """Contents of a simulated `Memory`
+
+    Writes go to `pending` and are applied to `data` on commit. The
+    evaluator slot `slot` counts the commits that changed the contents,
+    so that logic reading the memory can be made sensitive to it.
+    """
+    def __init__(self, memory, slot):
+        self.memory = memory
+        self.mask = 2**memory.width - 1
+        self.data = [0] * memory.depth
+        if memory.init is not None:
+            self.data[:len(memory.init)] = [v & self.mask
+                                            for v in memory.init]
+        self.pending = dict()
+        self.slot = slot
+
+
 class Evaluator:
-    def __init__(self, clock_domains, replaced_memories):
+    def __init__(self, clock_domains, memories=()):
         self.clock_domains = clock_domains
-        self.replaced_memories = replaced_memories
-        self.signal_values = dict()
-        self.modifications = dict()
+        # Every signal gets a dense integer slot. `values` holds the
+        # committed values, `next_values` the values after the next
+        # commit, and `dirty` the slots written since the last commit.
+        self.signals = []
+        self.slots = dict()
+        self.values = []
+        self.next_values = []
+        self.dirty = []
+        self.memories = dict()
+        self.dirty_memories = []
+        # Case -> width and signedness of the test, and case_table()
+        self._case_tables = dict()
+        for memory in memories:
+            self.get_memory(memory)
+
+    def _add_slot(self, signal, value):
+        slot = len(self.signals)
+        self.signals.append(signal)
+        self.values.append(value)
+        self.next_values.append(value)
+        return slot
+
+    def get_slot(self, signal):
+        try:
+            return self.slots[signal]
+        except KeyError:
+            slot = self._add_slot(signal, signal.reset.value)
+            self.slots[signal] = slot
+            return slot
+
+    def get_memory(self, memory):
+        try:
+            return self.memories[memory]
+        except KeyError:
+            state = MemoryState(memory, self._add_slot(None, 0))
+            self.memories[memory] = state
+            return state
+
+    def assign_slots(self, signals):
+        for signal in signals:
+            self.get_slot(signal)
+
+    def is_true(self, value):
+        """Whether the value of a `WaitUntil` condition holds"""
+        return bool(value)
+
+    def differs(self, value, reference):
+        """Whether the value of a `WaitChange` expression changed"""
+        return value != reference
 
     def commit(self):
-        r = set()
-        for k, v in self.modifications.items():
-            if k not in self.signal_values or self.signal_values[k] != v:
-                self.signal_values[k] = v
-                r.add(k)
-        self.modifications.clear()
+        values, next_values = self.values, self.next_values
+        r = []
+        for k in self.dirty:
+            v = next_values[k]
+            if values[k] != v:
+                values[k] = v
+                r.append(k)
+        self.dirty.clear()
+        for memory in self.dirty_memories:
+            data = memory.data
+            changed = False
+            for k, v in memory.pending.items():
+                if data[k] != v:
+                    data[k] = v
+                    changed = True
+            memory.pending.clear()
+            if changed:
+                k = memory.slot
+                values[k] = next_values[k] = values[k] + 1
+                r.append(k)
+        self.dirty_memories.clear()
         return r
 
     def eval(self, node, postcommit=False):  # noqa
@@ -109,14 +240,8 @@ class Evaluator:
             return node.value
         elif isinstance(node, Signal):
             if postcommit:
-                try:
-                    return self.modifications[node]
-                except KeyError:
-                    pass
-            try:
-                return self.signal_values[node]
-            except KeyError:
-                return node.reset.value
+                return self.next_values[self.get_slot(node)]
+            return self.values[self.get_slot(node)]
         elif isinstance(node, _Operator):
             operands = [self.eval(o, postcommit) for o in node.operands]
             if node.op == "-":
@@ -130,33 +255,37 @@ class Evaluator:
                 return str2op[node.op](*operands)
         elif isinstance(node, _Slice):
             v = self.eval(node.value, postcommit)
-            idx = range(node.start, node.stop)
-            return sum(((v >> i) & 1) << j for j, i in enumerate(idx))
+            return (v >> node.start) & ((1 << (node.stop - node.start)) - 1)
         elif isinstance(node, _Part):
             v = self.eval(node.value, postcommit)
             offset = self.eval(node.offset, postcommit)
-            idx = range(offset, offset + node.width)
-            return sum(((v >> i) & 1) << j for j, i in enumerate(idx))
+            return (v >> offset) & ((1 << node.width) - 1)
         elif isinstance(node, Cat):
             shift = 0
             r = 0
             for element in node.l:
                 nbits = len(element)
                 # make value always positive
-                r |= (self.eval(element, postcommit) & (2**nbits - 1)) << shift
+                r |= (self.eval(element, postcommit)
+                      & ((1 << nbits) - 1)) << shift
                 shift += nbits
             return r
         elif isinstance(node, Replicate):
             nbits = len(node.v)
-            v = self.eval(node.v, postcommit) & (2**nbits - 1)
-            return sum(v << i * nbits for i in range(node.n))
+            v = self.eval(node.v, postcommit) & ((1 << nbits) - 1)
+            return v * _replicate_unit(nbits, node.n)
         elif isinstance(node, _ArrayProxy):
             idx = min(len(node.choices) - 1, self.eval(node.key, postcommit))
             return self.eval(node.choices[idx], postcommit)
         elif isinstance(node, _MemoryLocation):
-            array = self.replaced_memories[node.memory]
-            return self.eval(array[self.eval(node.index, postcommit)],
-                             postcommit)
+            memory = self.get_memory(node.memory)
+            index = self.eval(node.index, postcommit)
+            if postcommit:
+                try:
+                    return memory.pending[index]
+                except KeyError:
+                    pass
+            return memory.data[index]
         elif isinstance(node, ClockSignal):
             return self.eval(self.clock_domains[node.cd].clk, postcommit)
         elif isinstance(node, ResetSignal):
@@ -176,36 +305,40 @@ class Evaluator:
     def assign(self, node, value):
         if isinstance(node, Signal):
             assert not node.variable
-            self.modifications[node] = _truncate(value,
-                                                 node.nbits, node.signed)
+            slot = self.get_slot(node)
+            self.next_values[slot] = _truncate(value, node.nbits, node.signed)
+            self.dirty.append(slot)
         elif isinstance(node, Cat):
             for element in node.l:
                 nbits = len(element)
-                self.assign(element, value & (2 ** nbits - 1))
+                self.assign(element, value & ((1 << nbits) - 1))
                 value >>= nbits
         elif isinstance(node, _Slice):
+            mask = (1 << (node.stop - node.start)) - 1
             full_value = self.eval(node.value, True)
             # clear bits assigned to by the slice
-            full_value &= ~((2 ** node.stop - 1) - (2 ** node.start - 1))
+            full_value &= ~(mask << node.start)
             # set them to the new value
-            value &= 2 ** (node.stop - node.start) - 1
-            full_value |= value << node.start
+            full_value |= (value & mask) << node.start
             self.assign(node.value, full_value)
         elif isinstance(node, _Part):
+            mask = (1 << node.width) - 1
             full_value = self.eval(node.value, True)
             offset = self.eval(node.offset, True)
-            start = offset
-            stop = offset + node.width
-            full_value &= ~((2**stop - 1) - (2**start - 1))
-            value &= 2**(stop - start) - 1
-            full_value |= value << start
+            full_value &= ~(mask << offset)
+            full_value |= (value & mask) << offset
             self.assign(node.value, full_value)
         elif isinstance(node, _ArrayProxy):
             idx = min(len(node.choices) - 1, self.eval(node.key))
             self.assign(node.choices[idx], value)
         elif isinstance(node, _MemoryLocation):
-            array = self.replaced_memories[node.memory]
-            self.assign(array[self.eval(node.index)], value)
+            memory = self.get_memory(node.memory)
+            index = self.eval(node.index)
+            if not 0 <= index < len(memory.data):
+                raise IndexError("Address {} out of range for memory {}"
+                                 .format(index, node.memory.name_override))
+            memory.pending[index] = value & memory.mask
+            self.dirty_memories.append(memory)
         else:
             raise NotImplementedError(node)
 
@@ -214,27 +347,121 @@ class Evaluator:
             if isinstance(s, _Assign):
                 self.assign(s.l, self.eval(s.r))
             elif isinstance(s, If):
-                if self.eval(s.cond) & (2**len(s.cond) - 1):
+                if self.eval(s.cond) & ((1 << len(s.cond)) - 1):
                     self.execute(s.t)
                 else:
                     self.execute(s.f)
             elif isinstance(s, Case):
-                nbits, signed = value_bits_sign(s.test)
+                try:
+                    nbits, signed, table, default = self._case_tables[s]
+                except KeyError:
+                    nbits, signed = value_bits_sign(s.test)
+                    table, default = case_table(s)
+                    self._case_tables[s] = nbits, signed, table, default
                 test = _truncate(self.eval(s.test), nbits, signed)
-                found = False
-                for k, v in s.cases.items():
-                    if isinstance(k, Constant) and k.value == test:
-                        self.execute(v)
-                        found = True
-                        break
-                if not found and "default" in s.cases:
-                    self.execute(s.cases["default"])
+                statements = table.get(test, default)
+                if statements is not None:
+                    self.execute(statements)
             elif isinstance(s, collections.Iterable):
                 self.execute(s)
             else:
                 raise NotImplementedError
 
 
+class _SensitivityLister(_InputLister):
+    def __init__(self, clock_domains):
+        super().__init__()
+        self.clock_domains = clock_domains
+
+    def visit_unknown(self, node):
+        if isinstance(node, _MemoryLocation):
+            if not self.target_context:
+                self.output_list.add(node.memory)
+            target_context, self.target_context = self.target_context, False
+            self.visit(node.index)
+            self.target_context = target_context
+
+    def visit_ClockSignal(self, node):
+        self.visit(self.clock_domains[node.cd].clk)
+
+    def visit_ResetSignal(self, node):
+        rst = self.clock_domains[node.cd].rst
+        if rst is not None:
+            self.visit(rst)
+
+
+def _strongly_connected_components(successors):
+    """Find the strongly connected components of a graph
+
+    `successors[n]` lists the successors of node `n`. The components are
+    returned in topological order (iterative Tarjan's algorithm).
+    """
+    n = len(successors)
+    index = [None] * n
+    lowlink = [0] * n
+    on_stack = [False] * n
+    stack = []
+    components = []
+    counter = 0
+    for root in range(n):
+        if index[root] is not None:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, iter(successors[root]))]
+        while work:
+            node, it = work[-1]
+            for successor in it:
+                if index[successor] is None:
+                    index[successor] = lowlink[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack[successor] = True
+                    work.append((successor, iter(successors[successor])))
+                    break
+                elif on_stack[successor]:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+    components.reverse()
+    return components
+
+
+def _dependency_graph(inputs, targets):
+    """Return the successor lists of the graph where node `n` reads
+    `inputs[n]` and drives `targets[n]`"""
+    drivers = dict()
+    for n, node_targets in enumerate(targets):
+        for target in node_targets:
+            drivers[target] = n
+    successors = [set() for _ in inputs]
+    for n, node_inputs in enumerate(inputs):
+        for i in node_inputs:
+            try:
+                successors[drivers[i]].add(n)
+            except KeyError:
+                pass
+    return [sorted(s) for s in successors]
+
+
+def _is_loop(component, successors):
+    return len(component) > 1 or component[0] in successors[component[0]]
+
+
 class DummyAsyncResetSynchronizerImpl(Module):
     def __init__(self, cd, async_reset):
         # TODO: asynchronous set
@@ -249,17 +476,176 @@ class DummyAsyncResetSynchronizer:
         return DummyAsyncResetSynchronizerImpl(dr.cd, dr.async_reset)
 
 
-# TODO: instances via Iverilog/VPI
+class _MemoryLowerer(ModuleTransformer):
+    """Express memory ports with statements on memory locations
+
+    Unlike `MemoryToArray`, the memory contents stay a single object that
+    the evaluator stores natively.
+    """
+    def __init__(self):
+        self.memories = []
+
+    @staticmethod
+    def _clamp(mem, adr):
+        # out of range addresses access the last word, like MemoryToArray
+        if 2**len(adr) > mem.depth:
+            return Mux(adr < mem.depth, adr, mem.depth - 1)
+        return adr
+
+    def transform_fragment(self, i, f):
+        newspecials = set()
+        processed_ports = set()
+
+        for mem in sorted(f.specials, key=hash):
+            if not isinstance(mem, Memory):
+                newspecials.add(mem)
+                continue
+            self.memories.append(mem)
+
+            for port in mem.ports:
+                try:
+                    sync = f.sync[port.clock.cd]
+                except KeyError:
+                    sync = f.sync[port.clock.cd] = []
+
+                adr = self._clamp(mem, port.adr)
+
+                # read
+                if port.async_read:
+                    f.comb.append(port.dat_r.eq(mem[adr]))
+                else:
+                    if port.mode == WRITE_FIRST:
+                        adr_reg = Signal.like(port.adr)
+                        rd_stmt = adr_reg.eq(port.adr)
+                        f.comb.append(port.dat_r.eq(
+                            mem[self._clamp(mem, adr_reg)]))
+                    elif port.mode == NO_CHANGE and port.we is not None:
+                        rd_stmt = If(~port.we, port.dat_r.eq(mem[adr]))
+                    else:  # NO_CHANGE without write capability reduces to READ_FIRST
+                        rd_stmt = port.dat_r.eq(mem[adr])
+                    if port.re is None:
+                        sync.append(rd_stmt)
+                    else:
+                        sync.append(If(port.re, rd_stmt))
+
+                # write
+                if port.we is not None:
+                    if port.we_granularity:
+                        n = mem.width // port.we_granularity
+                        for i in range(n):
+                            m = i * port.we_granularity
+                            M = (i + 1) * port.we_granularity
+                            # memory locations have no length, slice
+                            # them explicitly
+                            sync.append(If(port.we[i], _Slice(
+                                mem[adr], m, M).eq(port.dat_w[m:M])))
+                    else:
+                        sync.append(If(port.we, mem[adr].eq(port.dat_w)))
+
+                processed_ports.add(port)
+
+        newspecials -= processed_ports
+        f.specials = newspecials
+
+
+class _Command:
+    # lets coroutine testbenches ``await`` the command
+    def __await__(self):
+        return (yield self)
+
+
+class Yield:
+    """Coroutine command: ``await Yield(request)`` is the equivalent of
+    ``yield request`` in a generator
+
+    Coroutine testbenches use it to read and write signals, and to wait
+    for the next cycle with ``await Yield()``.
+    """
+    def __init__(self, request=None):
+        self.request = request
+
+    def __await__(self):
+        return (yield self.request)
+
+
+class WaitCycles(_Command):
+    """Generator command: resume after `n` cycles
+
+    ``yield WaitCycles(n)`` has the same effect as `n` plain ``yield``
+    statements, but the generator is not resumed in between, and the
+    simulator can skip cycles on which nothing happens.
+    """
+    def __init__(self, n):
+        self.n = n
+
+
+class WaitUntil(_Command):
+    """Generator command: resume on the first cycle on which `expr` is true
+
+    Equivalent to ``while not (yield expr): yield``, but the generator
+    is only resumed once the condition holds, and the condition is only
+    evaluated again when one of the signals it reads has changed.
+    """
+    def __init__(self, expr):
+        self.expr = wrap(expr)
+
+
+class WaitChange(_Command):
+    """Generator command: resume on the first cycle on which `expr` differs
+    from its value when the command was issued
+
+    Equivalent to::
+
+        value = (yield expr)
+        while (yield expr) == value:
+            yield
+
+    with the same savings as `WaitUntil`.
+    """
+    def __init__(self, expr):
+        self.expr = wrap(expr)
+
+
+def _frame(generator):
+    try:
+        return generator.gi_frame
+    except AttributeError:
+        return generator.cr_frame
+
+
+class _Waiter:
+    def __init__(self, command, value, slots):
+        self.command = command
+        self.value = value
+        self.slots = slots
+        # whether a signal read by the expression changed since the last
+        # evaluation
+        self.triggered = False
+
+    def done(self, evaluator, value):
+        if isinstance(self.command, WaitUntil):
+            return evaluator.is_true(value)
+        else:
+            return evaluator.differs(value, self.value)
+
+
 class Simulator:
     def __init__(self, fragment_or_module, generators, clocks={"sys": 10},  # noqa
-                 vcd_name=None, special_overrides={}):
+                 vcd_name=None, special_overrides={}, compiled=True,
+                 vcd_signals=None, vcd_start=0, vcd_stop=None,
+                 vcd_trigger=None, cosim=None, profile=None,
+                 simplify=False):
         if isinstance(fragment_or_module, _Fragment):
             self.fragment = fragment_or_module
         else:
             self.fragment = fragment_or_module.get_fragment()
+        if simplify:
+            self.fragment = fold_constants(self.fragment)
+            if simplify is not True:
+                remove_dead_logic(self.fragment, simplify)
 
-        mta = MemoryToArray()
-        mta.transform_fragment(None, self.fragment)
+        memories = _MemoryLowerer()
+        memories.transform_fragment(None, self.fragment)
 
         overrides = {AsyncResetSynchronizer: DummyAsyncResetSynchronizer}
         overrides.update(special_overrides)
@@ -267,10 +653,66 @@ class Simulator:
                                      specials=self.fragment.specials)
         self.fragment += fs
         self.fragment.specials -= lowered
+        instances = set()
+        if cosim is not None:
+            instances = {special for special in self.fragment.specials
+                         if isinstance(special, Instance)}
+            self.fragment.specials -= instances
         if self.fragment.specials:
             raise ValueError("Could not lower all specials",
                              self.fragment.specials)
 
+        self._init_generators(generators, clocks)
+
+        insert_resets(self.fragment)
+        # comb signals return to their reset value if nothing assigns them
+        self.fragment.comb[0:0] = [s.eq(s.reset)
+                                   for s in list_targets(self.fragment.comb)]
+        self.evaluator = self._create_evaluator(memories.memories)
+        signals = list_signals(self.fragment)
+        for cd in self.fragment.clock_domains:
+            signals.add(cd.clk)
+            if cd.rst is not None:
+                signals.add(cd.rst)
+        for instance in instances:
+            signals |= instance.list_ios(True, True, False)
+        self._signals = sorted(signals, key=hash)
+        self.evaluator.assign_slots(self._signals)
+        if compiled:
+            compiler = StatementCompiler(self.evaluator)
+            self._compile = compiler.compile
+        else:
+            self._compile = lambda statements, name: partial(
+                self.evaluator.execute, statements)
+        self._profile = profile
+        self.profiler = None
+        if profile:
+            self.profiler = Profiler()
+            for cd, generators in self.generators.items():
+                self.generators[cd] = [self.profiler.wrap_generator(g)
+                                       for g in generators]
+        self._sync = {cd: self._compile_sync(statements)
+                      for cd, statements in self.fragment.sync.items()}
+        self._build_comb_groups()
+
+        if vcd_name is None:
+            self.vcd = DummyVCDWriter()
+        else:
+            self.vcd = VCDWriter(vcd_name, self._signals,
+                                 patterns=vcd_signals, start=vcd_start,
+                                 stop=vcd_stop, enabled=vcd_trigger is None)
+            if self.profiler is not None:
+                self.vcd.set = self.profiler.wrap("vcd", "set", self.vcd.set)
+                self.vcd.delay = self.profiler.wrap("vcd", "delay",
+                                                    self.vcd.delay)
+        self._vcd_trigger = vcd_trigger
+
+        self.cosim = cosim
+        if cosim is not None:
+            cosim.start(instances, self.fragment.clock_domains,
+                        self.evaluator, self._list_input_slots)
+
+    def _init_generators(self, generators, clocks):
         if not isinstance(generators, dict):
             generators = {"sys": generators}
         self.generators = dict()
@@ -285,33 +727,24 @@ class Simulator:
         clocks = collections.OrderedDict(sorted(clocks.items(),
                                                 key=operator.itemgetter(0)))
         self.time = TimeManager(clocks)
+        # rising edges seen so far, per clock domain
+        self.cycles = collections.Counter()
+        # generator -> cycle of its domain on which it resumes
+        self._sleeping = dict()
+        # generator -> _Waiter, and slot -> waiters reading the slot
+        self._waiting = dict()
+        self._slot_waiters = collections.defaultdict(set)
+        # coroutine -> asyncio future it awaits
+        self._external = dict()
+        self._stepper = None
         for clock in clocks.keys():
             if clock not in self.fragment.clock_domains:
                 cd = ClockDomain(name=clock, reset_less=True)
                 cd.clk.reset = C(self.time.clocks[clock].high)
                 self.fragment.clock_domains.append(cd)
 
-        insert_resets(self.fragment)
-        # comb signals return to their reset value if nothing assigns them
-        self.fragment.comb[0:0] = [s.eq(s.reset)
-                                   for s in list_targets(self.fragment.comb)]
-        self.evaluator = Evaluator(self.fragment.clock_domains,
-                                   mta.replacements)
-
-        if vcd_name is None:
-            self.vcd = DummyVCDWriter()
-        else:
-            self.vcd = VCDWriter(vcd_name)
-
-            signals = list_signals(self.fragment)
-            for cd in self.fragment.clock_domains:
-                signals.add(cd.clk)
-                if cd.rst is not None:
-                    signals.add(cd.rst)
-            for memory_array in mta.replacements.values():
-                signals |= set(memory_array)
-            for signal in sorted(signals, key=hash):
-                self.vcd.set(signal, signal.reset.value)
+    def _create_evaluator(self, memories):
+        return Evaluator(self.fragment.clock_domains, memories)
 
     def __enter__(self):
         return self
@@ -321,18 +754,219 @@ class Simulator:
 
     def close(self):
         self.vcd.close()
+        if self.cosim is not None:
+            self.cosim.close()
+        if self.profiler is not None:
+            self.profiler.report()
+            if isinstance(self._profile, str):
+                self.profiler.write_json(self._profile)
+
+    def _compile_group(self, statements, kind):
+        function = self._compile(statements, kind)
+        if self.profiler is not None:
+            path, name = _statements_source(statements)
+            function = self.profiler.wrap(kind, name, function, path)
+        return function
+
+    def _compile_sync(self, statements):
+        if self.profiler is None:
+            return self._compile(statements, "sync")
+        # time each group of targets separately
+        functions = [self._compile_group(group, "sync")
+                     for _, group in group_by_targets(statements)]
+
+        def sync():
+            for function in functions:
+                function()
+        return sync
+
+    def _checkpoint_names(self):
+        # memories are named after the signals, like in the Verilog output
+        ns = build_namespace(self._signals)
+        signals = {ns.get_name(s): s for s in self._signals}
+        memories = {ns.get_name(m): state for m, state in sorted(
+            self.evaluator.memories.items(), key=lambda e: hash(e[0]))}
+        return signals, memories
+
+    def save(self, filename):
+        """Save the state of the design and of the clocks to a file
+
+        The state can be loaded into a fresh simulator of the same
+        design with `restore`. Generators are not part of the state.
+        Call this outside of `run`, e.g. after the generators that bring
+        the design into the desired state have finished.
+        """
+        signals, memories = self._checkpoint_names()
+        values, get_slot = self.evaluator.values, self.evaluator.get_slot
+        state = {
+            "signals": {name: values[get_slot(s)]
+                        for name, s in signals.items()},
+            "memories": {name: memory.data
+                         for name, memory in memories.items()},
+            "clocks": {cd: (cs.high, cs.next_transition)
+                       for cd, cs in self.time.clocks.items()},
+            "now": self.time.now,
+            "cycles": dict(self.cycles)
+        }
+        with open(filename, "wb") as f:
+            pickle.dump(state, f)
+
+    def restore(self, filename):
+        """Load a state saved with `save`
+
+        The simulator must simulate the same design with the same clocks,
+        which is checked through the names of the signals, memories and
+        clock domains. Simulation time continues from the saved time,
+        and the VCD output jumps to it.
+        """
+        with open(filename, "rb") as f:
+            state = pickle.load(f)
+        signals, memories = self._checkpoint_names()
+        if (set(state["signals"]) != set(signals)
+                or set(state["memories"]) != set(memories)
+                or set(state["clocks"]) != set(self.time.clocks)
+                or any(len(data) != len(memories[name].data)
+                       for name, data in state["memories"].items())):
+            raise ValueError("Checkpoint {} does not match the simulated"
+                             " design".format(filename))
+
+        evaluator = self.evaluator
+        for name, value in state["signals"].items():
+            slot = evaluator.get_slot(signals[name])
+            evaluator.values[slot] = evaluator.next_values[slot] = value
+        for name, data in state["memories"].items():
+            # compiled code keeps references to the data
+            memories[name].data[:] = data
+        for cd, (high, next_transition) in state["clocks"].items():
+            self.time.clocks[cd].high = high
+            self.time.clocks[cd].next_transition = next_transition
+        self.time.reschedule()
+        self.time.now = state["now"]
+        self.cycles = collections.Counter(state["cycles"])
+
+        self.vcd.delay(self.time.now)
+        for name, value in state["signals"].items():
+            self.vcd.set(signals[name], value)
+
+    def _build_comb_groups(self):
+        groups = group_by_targets(self.fragment.comb)
+        inputs = [self._list_inputs(statements) for _, statements in groups]
+        successors = _dependency_graph(inputs, [t for t, _ in groups])
+
+        # Levelize: strongly connected components of the group dependency
+        # graph become units, executed in topological order. Acyclic units
+        # run once per propagation, loops are iterated until they settle.
+        get_slot = self._get_input_slot
+        self._comb_units = []
+        readers = collections.defaultdict(set)
+        self._comb_drivers = dict()
+        for u, component in enumerate(
+                _strongly_connected_components(successors)):
+            functions = [self._compile_group(groups[k][1], "comb")
+                         for k in component]
+            if _is_loop(component, successors):
+                self._report_loop([groups[k][1] for k in component])
+                loop_inputs = {get_slot(signal) for k in component
+                               for signal in inputs[k]}
+            else:
+                loop_inputs = None
+            self._comb_units.append((functions, loop_inputs))
+            for k in component:
+                for signal in inputs[k]:
+                    readers[get_slot(signal)].add(u)
+                for signal in groups[k][0]:
+                    self._comb_drivers[self.evaluator.get_slot(signal)] = u
+        self._comb_readers = {k: sorted(v) for k, v in readers.items()}
+
+    def _get_input_slot(self, signal_or_memory):
+        if isinstance(signal_or_memory, Memory):
+            return self.evaluator.get_memory(signal_or_memory).slot
+        return self.evaluator.get_slot(signal_or_memory)
+
+    def _list_input_slots(self, node):
+        return {self._get_input_slot(signal)
+                for signal in self._list_inputs(node)}
+
+    def _list_inputs(self, node):
+        lister = _SensitivityLister(self.fragment.clock_domains)
+        lister.visit(node)
+        return lister.output_list
+
+    def _list_assignments(self, statements, conditions=frozenset()):
+        for s in statements:
+            if isinstance(s, _Assign):
+                yield list_targets(s), self._list_inputs(s) | conditions
+            elif isinstance(s, If):
+                c = conditions | self._list_inputs(s.cond)
+                yield from self._list_assignments(s.t, c)
+                yield from self._list_assignments(s.f, c)
+            elif isinstance(s, Case):
+                c = conditions | self._list_inputs(s.test)
+                for case in s.cases.values():
+                    yield from self._list_assignments(case, c)
+            else:
+                yield from self._list_assignments(s, conditions)
+
+    def _report_loop(self, group_statements):
+        # Groups can depend on each other without the signals forming a
+        # loop, e.g. when one statement assigns several signals. Only
+        # report cycles between individual assignments.
+        assignments = list(self._list_assignments(group_statements))
+        successors = _dependency_graph([i for t, i in assignments],
+                                       [t for t, i in assignments])
+        loops = [c for c in _strongly_connected_components(successors)
+                 if _is_loop(c, successors)]
+        if not loops:
+            return
+        ns = build_namespace(list_signals(self.fragment))
+        for loop in loops:
+            signals = set()
+            for n in loop:
+                signals |= assignments[n][0]
+            logging.warning("Combinational loop through signals: {}".format(
+                ", ".join(sorted(ns.get_name(s) for s in signals))))
+
+    def _execute_comb(self):
+        self._comb_propagate(list(range(len(self._comb_units))), [])
 
     def _commit_and_comb_propagate(self):
-        # TODO: optimize
-        all_modified = set()
         modified = self.evaluator.commit()
-        all_modified |= modified
-        while modified:
-            self.evaluator.execute(self.fragment.comb)
-            modified = self.evaluator.commit()
-            all_modified |= modified
-        for signal in all_modified:
-            self.vcd.set(signal, self.evaluator.signal_values[signal])
+        pending = set()
+        for slot in modified:
+            pending.update(self._comb_readers.get(slot, ()))
+            # something else overwrote a comb signal: restore it
+            try:
+                pending.add(self._comb_drivers[slot])
+            except KeyError:
+                pass
+        return self._comb_propagate(sorted(pending), modified)
+
+    def _comb_propagate(self, pending, all_modified):
+        commit = self.evaluator.commit
+        readers = self._comb_readers
+        units = self._comb_units
+        scheduled = set(pending)
+        while pending:
+            u = heapq.heappop(pending)
+            scheduled.remove(u)
+            functions, loop_inputs = units[u]
+            while True:
+                for function in functions:
+                    function()
+                modified = commit()
+                all_modified += modified
+                for slot in modified:
+                    for reader in readers.get(slot, ()):
+                        if reader > u and reader not in scheduled:
+                            scheduled.add(reader)
+                            heapq.heappush(pending, reader)
+                if loop_inputs is None or loop_inputs.isdisjoint(modified):
+                    break
+        signals, values = self.evaluator.signals, self.evaluator.values
+        for slot in set(all_modified):
+            if signals[slot] is not None:
+                self.vcd.set(signals[slot], values[slot])
+        return all_modified
 
     def _evalexec_nested_lists(self, x):
         if isinstance(x, list):
@@ -347,13 +981,48 @@ class Simulator:
 
     def _process_generators(self, cd):  # noqa
         exhausted = []
+        sleeping = self._sleeping
+        cycle = self.cycles[cd]
+        waiting = self._waiting
+        external = self._external
         for generator in self.generators[cd]:
+            if generator in sleeping:
+                if sleeping[generator] > cycle:
+                    continue
+                del sleeping[generator]
+            if generator in waiting:
+                waiter = waiting[generator]
+                if not waiter.triggered:
+                    continue
+                waiter.triggered = False
+                if not waiter.done(self.evaluator,
+                                   self.evaluator.eval(waiter.command.expr)):
+                    continue
+                self._remove_waiter(generator)
+            if generator in external:
+                # the future returns its result or raises its exception
+                # when the coroutine is resumed
+                if not external[generator].done():
+                    continue
+                del external[generator]
             reply = None
             while True:
                 try:
                     request = generator.send(reply)
                     if request is None:
                         break  # next cycle
+                    elif isinstance(request, WaitCycles):
+                        reply = None
+                        if request.n > 0:
+                            sleeping[generator] = cycle + request.n
+                            break
+                    elif isinstance(request, (WaitUntil, WaitChange)):
+                        reply = None
+                        value = self.evaluator.eval(request.expr)
+                        if not (isinstance(request, WaitUntil)
+                                and self.evaluator.is_true(value)):
+                            self._add_waiter(generator, request, value)
+                            break
                     elif isinstance(request, str):
                         if request == "passive":
                             self.passive_generators.add(generator)
@@ -362,11 +1031,17 @@ class Simulator:
                         else:
                             raise ValueError("Unknown simulator command: '{}'"
                                              .format(request))
+                    elif asyncio.isfuture(request):
+                        # awaited by a coroutine: resume it once the
+                        # event loop has completed the future
+                        request._asyncio_future_blocking = False
+                        external[generator] = request
+                        break
                     else:
                         try:
                             reply = self._evalexec_nested_lists(request)
                         except Exception:
-                            tb = inspect.getframeinfo(generator.gi_frame)
+                            tb = inspect.getframeinfo(_frame(generator))
                             print("While evaluating the following generator, an error occurred:")
                             print("  File {}, line {}, in {}".format(tb.filename, tb.lineno, tb.function))
                             for c in tb.code_context:
@@ -379,31 +1054,223 @@ class Simulator:
         for generator in exhausted:
             self.generators[cd].remove(generator)
 
+    def _add_waiter(self, generator, command, value):
+        slots = self._list_input_slots(command.expr)
+        waiter = _Waiter(command, value, slots)
+        self._waiting[generator] = waiter
+        for slot in slots:
+            self._slot_waiters[slot].add(waiter)
+
+    def _remove_waiter(self, generator):
+        waiter = self._waiting.pop(generator)
+        for slot in waiter.slots:
+            self._slot_waiters[slot].discard(waiter)
+            if not self._slot_waiters[slot]:
+                del self._slot_waiters[slot]
+
+    def _trigger_waiters(self, modified):
+        slot_waiters = self._slot_waiters
+        if slot_waiters:
+            for slot in modified:
+                for waiter in slot_waiters.get(slot, ()):
+                    waiter.triggered = True
+
     def _continue_simulation(self):
         for cd_generators in self.generators.values():
             if set(cd_generators) - self.passive_generators:
                 return True
         return False
 
-    def run(self):
-        self.evaluator.execute(self.fragment.comb)
-        self._commit_and_comb_propagate()
+    def _skip_idle_cycles(self):
+        # All clock domains are at a fixed point: clock edges change
+        # nothing until a generator resumes, so jump to the first wake-up.
+        until = None
+        for cd, generators in self.generators.items():
+            for generator in generators:
+                waiter = self._waiting.get(generator)
+                if waiter is not None and not waiter.triggered:
+                    # the condition can only change when a generator
+                    # writes to the design
+                    continue
+                try:
+                    wake = self._sleeping[generator]
+                except KeyError:
+                    return
+                t = self.time.rising_edge_time(cd, wake - self.cycles[cd])
+                if until is None or t < until:
+                    until = t
+        if until is None:
+            return
+        for cd, n in self.time.skip(until).items():
+            self.cycles[cd] += n
+            clk = self.fragment.clock_domains[cd].clk
+            self.evaluator.assign(clk, int(self.time.clocks[cd].high))
+        self._trigger_waiters(self.evaluator.commit())
+
+    def _settle_cosim(self, modified):
+        # Exchange port values with the co-simulated instances until
+        # neither side changes anything.
+        all_modified = list(modified or ())
+        for i in range(1000):
+            updates = self.cosim.settle(modified)
+            if not updates:
+                return all_modified
+            for expr, value in updates:
+                self.evaluator.assign(expr, value)
+            modified = self._commit_and_comb_propagate()
+            all_modified += modified
+        raise RuntimeError("Co-simulated instances did not settle")
+
+    def _steps(self, skip_idle=True):  # noqa
+        # Simulate one time step per iteration. The first value is yielded
+        # once the initial state is computed, the next ones after each
+        # time step: False when the step only changed clocks, True when
+        # generators may have run.
+        self._execute_comb()
+        if self.cosim is not None:
+            self._settle_cosim(None)
+
+        clock_domains = self.fragment.clock_domains
+        get_slot = self.evaluator.get_slot
+        clock_slots = {get_slot(clock_domains[cd].clk)
+                       for cd in self.time.clocks}
+        # When no logic reads a clock, falling edges only change the
+        # clocks, and cycles on which no signal changes leave the design
+        # in the same state for the next ones.
+        clocks_read = (
+            any(slot in self._comb_readers for slot in clock_slots)
+            or any(get_slot(signal) in clock_slots
+                   for statements in self.fragment.sync.values()
+                   for signal in self._list_inputs(statements)
+                   if isinstance(signal, Signal))
+            or self.cosim is not None)
+        can_skip = (skip_idle and not clocks_read
+                    and isinstance(self.vcd, DummyVCDWriter))
+        idle = set()
+        yield False
 
         while True:
             dt, rising, falling = self.time.tick()
             self.vcd.delay(dt)
+            if self.cosim is not None:
+                # registered outputs of the instances change with the
+                # synchronous signals
+                for expr, value in self.cosim.clock(rising, falling):
+                    self.evaluator.assign(expr, value)
             for cd in rising:
-                self.evaluator.assign(self.fragment.clock_domains[cd].clk, 1)
-                if cd in self.fragment.sync:
-                    self.evaluator.execute(self.fragment.sync[cd])
+                self.cycles[cd] += 1
+                self.evaluator.assign(clock_domains[cd].clk, 1)
+                if cd in self._sync:
+                    self._sync[cd]()
                 if cd in self.generators:
                     self._process_generators(cd)
             for cd in falling:
-                self.evaluator.assign(self.fragment.clock_domains[cd].clk, 0)
-            self._commit_and_comb_propagate()
+                self.evaluator.assign(clock_domains[cd].clk, 0)
+            if not rising and not clocks_read:
+                modified = self.evaluator.commit()
+                self._trigger_waiters(modified)
+                for slot in modified:
+                    self.vcd.set(self.evaluator.signals[slot],
+                                 self.evaluator.values[slot])
+                yield False
+                continue
+            modified = self._commit_and_comb_propagate()
+            if self.cosim is not None:
+                modified = self._settle_cosim(modified)
+            self._trigger_waiters(modified)
+            if (self._vcd_trigger is not None
+                    and self.evaluator.eval(self._vcd_trigger)):
+                self.vcd.enable()
+                self._vcd_trigger = None
+
+            yield True
+
+            if can_skip:
+                if clock_slots.issuperset(modified):
+                    idle |= rising
+                    if len(idle) == len(self.time.clocks):
+                        self._skip_idle_cycles()
+                else:
+                    idle.clear()
+
+    def run(self):
+        for full_step in self._steps():
+            if full_step:
+                if self._external:
+                    raise RuntimeError("Testbenches awaiting asyncio futures"
+                                       " must be run with run_async()")
+                if not self._continue_simulation():
+                    break
 
-            if not self._continue_simulation():
+    def read(self, expr):
+        """Return the current value of `expr`
+
+        For code outside of the testbenches, e.g. asyncio tasks running
+        next to `run_async` or between calls to `step`.
+        """
+        return self.evaluator.eval(wrap(expr))
+
+    def write(self, target, value):
+        """Assign `value` to `target` before the next time step
+
+        Like writes of the testbenches, the value is visible after the
+        next clock edge.
+        """
+        self.evaluator.assign(target, value)
+
+    def _async_steps(self):
+        if self._stepper is None:
+            # idle cycles are not skipped: asyncio code may write to the
+            # design at any time step
+            self._stepper = self._steps(skip_idle=False)
+            next(self._stepper)
+        return self._stepper
+
+    async def _async_step(self, steps):
+        blocking = [future for generator, future in self._external.items()
+                    if generator not in self.passive_generators
+                    and not future.done()]
+        if blocking:
+            # time stands still until an active testbench can continue
+            await asyncio.wait(blocking, return_when=asyncio.FIRST_COMPLETED)
+        if self.evaluator.dirty or self.evaluator.dirty_memories:
+            self._trigger_waiters(self._commit_and_comb_propagate())
+        return next(steps)
+
+    async def run_async(self, yield_every=100):
+        """Coroutine running the simulation like `run`, within an asyncio
+        event loop
+
+        Testbenches may then be coroutines awaiting asyncio futures (e.g.
+        data from sockets or from other tasks) as well as simulator
+        commands. The event loop runs other tasks every `yield_every` time
+        steps, and whenever all active testbenches await futures.
+        """
+        steps = self._async_steps()
+        n = 0
+        while True:
+            if (await self._async_step(steps)
+                    and not self._continue_simulation()):
                 break
+            n += 1
+            if n == yield_every:
+                n = 0
+                await asyncio.sleep(0)
+
+    async def step(self, cycles=1, domain="sys"):
+        """Coroutine advancing the simulation by `cycles` rising edges of
+        the clock of `domain`
+
+        Testbenches run as usual, and the simulation is paused between
+        calls, so that asyncio code can inspect and drive the design with
+        `read` and `write`.
+        """
+        if domain not in self.time.clocks:
+            raise KeyError("Unknown clock domain: '{}'".format(domain))
+        steps = self._async_steps()
+        end = self.cycles[domain] + cycles
+        while self.cycles[domain] < end:
+            await self._async_step(steps)
 
 
 def run_simulation(*args, **kwargs):
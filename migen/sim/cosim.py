@@ -0,0 +1,243 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from copy import copy
+
+from migen.fhdl.structure import *  # noqa
+from migen.fhdl.specials import Instance
+from migen.fhdl.namer import build_namespace
+
+
+__all__ = ["IcarusCosimulation"]
+
+
+_unknown_digits = re.compile("[xXzZ]")
+
+
+class _Port:
+    def __init__(self, index, item, signal):
+        self.index = index
+        self.item = item
+        self.expr = item.expr
+        self.signal = signal
+        self.mask = 2**len(signal) - 1
+
+
+def _clock_domain(expr, clock_domains):
+    if isinstance(expr, ClockSignal):
+        return expr.cd
+    for cd in clock_domains:
+        if expr is cd.clk:
+            return cd.name
+    return None
+
+
+def _wrapper(instances, inputs, outputs):
+    """Verilog top level exchanging port values over stdin/stdout
+
+    Each line read from stdin is either ``<input index> <hex value>``,
+    or ``-1 0`` to let the design settle and print the outputs that
+    changed since the previous exchange, followed by ``@migen end``.
+    """
+    ns = build_namespace([p.signal for p in inputs + outputs])
+    r = "module migen_cosim;\n\n"
+    for p in inputs:
+        r += "reg [{}:0] {} = 0;\n".format(
+            len(p.signal) - 1, ns.get_name(p.signal))
+    for p in outputs:
+        name = ns.get_name(p.signal)
+        r += "wire [{0}:0] {1};\nreg [{0}:0] {1}_last;\n".format(
+            len(p.signal) - 1, name)
+    r += "\n"
+    for instance in instances:
+        r += Instance.emit_verilog(instance, ns, None)
+    width = max([len(p.signal) for p in inputs] + [1])
+    r += """integer index;
+integer count;
+reg [{}:0] value;
+
+initial begin
+\twhile (1) begin
+\t\tcount = $fscanf(32'h8000_0000, "%d %h\\n", index, value);
+\t\tif (count != 2)
+\t\t\t$finish;
+\t\tif (index == -1) begin
+\t\t\t#1;
+""".format(width - 1)
+    for p in outputs:
+        name = ns.get_name(p.signal)
+        r += """\t\t\tif ({0} !== {0}_last) begin
+\t\t\t\t$display("@migen {1} %h", {0});
+\t\t\t\t{0}_last = {0};
+\t\t\tend
+""".format(name, p.index)
+    r += """\t\t\t$display("@migen end");
+\t\t\t$fflush;
+\t\tend else begin
+\t\t\tcase (index)
+"""
+    for p in inputs:
+        r += "\t\t\t\t{}: {} = value;\n".format(p.index, ns.get_name(p.signal))
+    r += """\t\t\tendcase
+\t\tend
+\tend
+end
+
+endmodule
+"""
+    return r
+
+
+class IcarusCosimulation:
+    """Simulate `Instance` specials with Icarus Verilog
+
+    Pass an object of this class as the `cosim` argument of `Simulator`.
+    The instances of the design are then not lowered, but instantiated in
+    a Verilog top level that is compiled with the modules defined in
+    `sources` and run by ``vvp`` next to the Python simulator.
+
+    Both simulators exchange the values of the ports that changed, once
+    at each clock edge and then until the outputs of the instances and
+    the Migen logic settle. Inputs connected to a clock domain's clock
+    change first, so that the instances sample their other inputs as
+    they were before the edge, like the Migen synchronous logic does.
+    Each exchange advances the Verilog time by one unit.
+    """
+    def __init__(self, sources, build_dir=None, iverilog="iverilog",
+                 vvp="vvp", options=[]):
+        self.sources = sources
+        self.build_dir = build_dir
+        self.iverilog = iverilog
+        self.vvp = vvp
+        self.options = options
+        self.process = None
+
+    def start(self, instances, clock_domains, evaluator, input_slots):
+        """Compile and start the Verilog simulation
+
+        `input_slots(expr)` returns the evaluator slots read by `expr`.
+        """
+        self.evaluator = evaluator
+        inputs = []
+        outputs = []
+        shadows = []
+        for instance in sorted(instances, key=hash):
+            shadow = copy(instance)
+            shadow.items = []
+            for item in instance.items:
+                if isinstance(item, Instance.Input):
+                    ports, prefix = inputs, "migen_in"
+                elif isinstance(item, Instance.Output):
+                    ports, prefix = outputs, "migen_out"
+                elif isinstance(item, Instance.InOut):
+                    raise NotImplementedError(
+                        "InOut ports of {} cannot be co-simulated"
+                        .format(instance.of))
+                else:
+                    shadow.items.append(item)
+                    continue
+                signal = Signal(len(item.expr), name_override="{}{}".format(
+                    prefix, len(ports)))
+                ports.append(_Port(len(ports), item, signal))
+                shadow.items.append(type(item)(item.name, signal))
+            shadows.append(shadow)
+
+        self.outputs = outputs
+        self.clock_inputs = []
+        self.data_inputs = []
+        self.slot_inputs = dict()
+        for p in inputs:
+            p.cd = _clock_domain(p.expr, clock_domains)
+            if p.cd is None:
+                self.data_inputs.append(p)
+                for slot in input_slots(p.expr):
+                    self.slot_inputs.setdefault(slot, []).append(p)
+            else:
+                self.clock_inputs.append(p)
+        self.sent = dict()
+
+        build_dir = self.build_dir
+        if build_dir is None:
+            build_dir = tempfile.mkdtemp(prefix="migen_cosim")
+        os.makedirs(build_dir, exist_ok=True)
+        wrapper_file = os.path.join(build_dir, "migen_cosim.v")
+        with open(wrapper_file, "w") as f:
+            f.write(_wrapper(shadows, inputs, outputs))
+        vvp_file = os.path.join(build_dir, "migen_cosim.vvp")
+        if subprocess.call([self.iverilog, "-o", vvp_file, "-s", "migen_cosim"]
+                           + list(self.options) + [wrapper_file]
+                           + list(self.sources)):
+            raise OSError("Subprocess failed")
+        self.process = subprocess.Popen(
+            [self.vvp, "-n", vvp_file], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, universal_newlines=True)
+
+    def _exchange(self, changes):
+        self.process.stdin.write("".join(
+            "{} {:x}\n".format(p.index, value & p.mask)
+            for p, value in changes) + "-1 0\n")
+        self.process.stdin.flush()
+        updates = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise OSError("Verilog simulator exited")
+            if not line.startswith("@migen "):
+                # output of the simulated Verilog code
+                sys.stdout.write(line)
+                continue
+            words = line.split()
+            if words[1] == "end":
+                return updates
+            value = int(_unknown_digits.sub("0", words[2]), 16)
+            updates.append((self.outputs[int(words[1])].expr, value))
+
+    def _changes(self, ports):
+        changes = []
+        for p in ports:
+            value = self.evaluator.eval(p.expr)
+            if self.sent.get(p) != value:
+                self.sent[p] = value
+                changes.append((p, value))
+        return changes
+
+    def clock(self, rising, falling):
+        """Send the clock edges of a time step, return output updates"""
+        changes = []
+        for p in self.clock_inputs:
+            if p.cd in rising:
+                changes.append((p, 1))
+            elif p.cd in falling:
+                changes.append((p, 0))
+        if not changes:
+            return []
+        for p, value in changes:
+            self.sent[p] = value
+        return self._exchange(changes)
+
+    def settle(self, modified=None):
+        """Send the inputs that changed, return output updates
+
+        `modified` lists the slots that changed since the last call; all
+        inputs are sent if it is None.
+        """
+        if modified is None:
+            ports = self.clock_inputs + self.data_inputs
+        else:
+            ports = set()
+            for slot in modified:
+                ports.update(self.slot_inputs.get(slot, ()))
+            ports = sorted(ports, key=lambda p: p.index)
+        changes = self._changes(ports)
+        if not changes and modified is not None:
+            return []
+        return self._exchange(changes)
+
+    def close(self):
+        if self.process is not None:
+            # end of input terminates the Verilog simulation
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
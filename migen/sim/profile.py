@@ -0,0 +1,194 @@
+import json
+import sys
+import time
+from collections import defaultdict
+
+from migen.fhdl.structure import Signal, _Slice, _Part
+from migen.fhdl.specials import _MemoryLocation
+from migen.fhdl.tools import list_targets
+from migen.fhdl.visit import NodeVisitor
+
+
+__all__ = ["Profiler"]
+
+
+def _hierarchy(signal):
+    path = []
+    for name, number in signal.backtrace:
+        if name is not None and (not path or path[-1] != name):
+            path.append(name)
+    return path
+
+
+class _MemoryFinder(NodeVisitor):
+    def __init__(self):
+        self.memories = []
+
+    def visit_Assign(self, node):
+        target = node.l
+        while isinstance(target, (_Slice, _Part)):
+            target = target.value
+        if isinstance(target, _MemoryLocation):
+            self.memories.append(target.memory)
+
+
+def _statements_source(statements):
+    """Return the module path and a name for a group of statements
+
+    Groups are named after the signal they assign to with the shortest
+    source hierarchy, which usually belongs to the module that contains
+    the statements, or after the memory they write to.
+    """
+    targets = [t for t in list_targets(statements) if isinstance(t, Signal)]
+    if targets:
+        path = min((_hierarchy(t) for t in targets),
+                   key=lambda path: (len(path), path))
+        name = path[-1]
+        if len(targets) > 1:
+            name += " (+{})".format(len(targets) - 1)
+        return path[:-1], name
+    finder = _MemoryFinder()
+    finder.visit(statements)
+    if finder.memories:
+        return [], "memory " + finder.memories[0].name_override
+    return [], "(no targets)"
+
+
+class _Entry:
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.count = 0
+        self.time = 0.0
+
+
+class _ProfiledGenerator:
+    def __init__(self, profiler, generator):
+        self.profiler = profiler
+        self.generator = generator
+        self.entry = profiler.entry("generator", generator.__qualname__)
+
+    @property
+    def gi_frame(self):
+        try:
+            return self.generator.gi_frame
+        except AttributeError:
+            # coroutine
+            return self.generator.cr_frame
+
+    def send(self, value):
+        start = time.perf_counter()
+        try:
+            return self.generator.send(value)
+        finally:
+            self.entry.count += 1
+            self.entry.time += time.perf_counter() - start
+
+
+class Profiler:
+    """Count and time the activities of a simulator
+
+    Each entry is identified by a category (``sync``, ``comb``,
+    ``generator`` or ``vcd``) and a name, and records how many times the
+    activity ran and the time it took, in seconds. Statement groups are
+    named after their source hierarchy, generators after their function.
+    """
+    def __init__(self):
+        self.entries = dict()
+
+    def entry(self, category, name, path=()):
+        key = (category, ".".join(list(path) + [name]))
+        try:
+            return self.entries[key]
+        except KeyError:
+            entry = _Entry(list(path), name)
+            self.entries[key] = entry
+            return entry
+
+    def wrap(self, category, name, function, path=()):
+        """Return `function`, timed as the entry `name` of `category`
+
+        `path` is the source hierarchy of the entry, if any.
+        """
+        entry = self.entry(category, name, path)
+        perf_counter = time.perf_counter
+
+        def wrapper(*args):
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                entry.count += 1
+                entry.time += perf_counter() - start
+        return wrapper
+
+    def wrap_generator(self, generator):
+        return _ProfiledGenerator(self, generator)
+
+    def _common_depth(self):
+        # source hierarchies start with the frames that elaborated the
+        # design, which are the same for all signals
+        paths = [entry.path for entry in self.entries.values()
+                 if entry.path]
+        if not paths:
+            return 0
+        depth = 0
+        for names in zip(*paths):
+            if any(name != names[0] for name in names):
+                break
+            depth += 1
+        return depth
+
+    def results(self, sort="time"):
+        """Return the entries as a list of dictionaries
+
+        `sort` is one of ``time``, ``count``, ``name`` or ``category``;
+        times and counts are sorted in decreasing order.
+        """
+        depth = self._common_depth()
+        r = []
+        for (category, _), entry in self.entries.items():
+            path = entry.path[depth:]
+            r.append({"category": category,
+                      "name": ".".join(path + [entry.name]),
+                      "module": ".".join(path),
+                      "count": entry.count, "time": entry.time})
+        if sort in ("time", "count"):
+            r.sort(key=lambda e: (-e[sort], e["category"], e["name"]))
+        elif sort in ("name", "category"):
+            r.sort(key=lambda e: (e[sort], e["name"]))
+        else:
+            raise ValueError("Unknown sort key: '{}'".format(sort))
+        return r
+
+    def modules(self):
+        """Return the total time of the statements of each module
+
+        Times include the submodules.
+        """
+        r = defaultdict(float)
+        for e in self.results():
+            if e["category"] in ("sync", "comb"):
+                path = e["module"].split(".") if e["module"] else []
+                for i in range(len(path) + 1):
+                    r[".".join(path[:i])] += e["time"]
+        return dict(r)
+
+    def report(self, file=None, sort="time", limit=None):
+        if file is None:
+            file = sys.stdout
+        results = self.results(sort)
+        total = sum(e["time"] for e in results)
+        print("{:>10} {:>10} {:>6}  {:10} {}".format(
+            "time (s)", "count", "%", "category", "name"), file=file)
+        for e in results[:limit]:
+            print("{:10.4f} {:10} {:6.1f}  {:10} {}".format(
+                e["time"], e["count"],
+                100 * e["time"] / total if total else 0.0,
+                e["category"], e["name"]), file=file)
+        print("{:10.4f} total".format(total), file=file)
+
+    def write_json(self, filename, sort="time"):
+        with open(filename, "w") as f:
+            json.dump({"entries": self.results(sort),
+                       "modules": self.modules()}, f, indent=1)
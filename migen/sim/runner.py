@@ -0,0 +1,102 @@
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from migen.sim.core import Simulator
+
+
+__all__ = ["SimulationJob", "SimulationResult", "run_regression",
+           "print_report"]
+
+
+class SimulationJob:
+    """A testbench to be run by `run_regression`
+
+    Jobs are sent to worker processes, so they are described by picklable
+    callables (e.g. module level functions and classes) rather than by
+    modules and generators. `factory()` elaborates the design, and
+    `generators(dut)` returns the generators to run against it, in any
+    form accepted by `run_simulation`. Remaining keyword arguments (e.g.
+    `vcd_name`) are passed to the `Simulator`.
+    """
+    def __init__(self, factory, generators, clocks={"sys": 10}, name=None,
+                 **kwargs):
+        self.factory = factory
+        self.generators = generators
+        self.clocks = clocks
+        if name is None:
+            name = getattr(factory, "__qualname__", repr(factory))
+        self.name = name
+        self.kwargs = kwargs
+
+
+class SimulationResult:
+    def __init__(self, name, passed, error, cycles, vcd_name, wall_time):
+        self.name = name
+        self.passed = passed
+        # formatted traceback: exceptions do not always survive pickling
+        self.error = error
+        self.cycles = cycles
+        self.vcd_name = vcd_name
+        self.wall_time = wall_time
+
+    def __repr__(self):
+        return "<SimulationResult {} {} {:.3f}s>".format(
+            self.name, "passed" if self.passed else "failed", self.wall_time)
+
+
+def _run_job(job):
+    start = time.perf_counter()
+    sim = None
+    error = None
+    try:
+        dut = job.factory()
+        sim = Simulator(dut, job.generators(dut), job.clocks, **job.kwargs)
+        with sim:
+            sim.run()
+    except Exception:
+        error = traceback.format_exc()
+    return SimulationResult(
+        job.name, error is None, error,
+        dict(sim.cycles) if sim is not None else {},
+        job.kwargs.get("vcd_name"), time.perf_counter() - start)
+
+
+def run_regression(jobs, processes=None):
+    """Run simulation jobs in parallel and return their results
+
+    `processes` is the number of worker processes, by default the number
+    of CPUs. With `processes=1`, jobs are run one after the other in the
+    calling process, which is convenient for debugging. Results are
+    returned in the order of `jobs`.
+    """
+    if processes == 1:
+        return [_run_job(job) for job in jobs]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(_run_job, jobs))
+
+
+def print_report(results, file=None):
+    """Print one line per result and the errors of failed jobs
+
+    Returns True if all jobs passed.
+    """
+    if file is None:
+        file = sys.stdout
+    for result in results:
+        cycles = ", ".join("{}={}".format(cd, n)
+                           for cd, n in sorted(result.cycles.items()))
+        print("{:4} {:8.3f}s  {}  [{}]{}".format(
+            "PASS" if result.passed else "FAIL", result.wall_time,
+            result.name, cycles,
+            "" if result.vcd_name is None else " " + result.vcd_name),
+            file=file)
+    failed = [result for result in results if not result.passed]
+    for result in failed:
+        print("\n{} failed:\n{}".format(result.name, result.error),
+              file=file)
+    print("{} passed, {} failed, {:.3f}s total job time".format(
+        len(results) - len(failed), len(failed),
+        sum(result.wall_time for result in results)), file=file)
+    return not failed
@@ -0,0 +1,146 @@
+from migen.genlib.record import Record
+
+
+__all__ = ["StreamDriver", "StreamMonitor"]
+
+
+def _payload_list(payloads):
+    # NumPy arrays convert to Python integers in one go
+    try:
+        return payloads.tolist()
+    except AttributeError:
+        return [int(p) for p in payloads]
+
+
+class _StreamStatistics:
+    def _reset_statistics(self):
+        self.cycles = 0
+        self.transfers = 0
+        self.stalls = 0
+
+    @property
+    def throughput(self):
+        """Transfers per cycle"""
+        return self.transfers / self.cycles if self.cycles else 0.0
+
+    def __repr__(self):
+        return "<{} {} transfers in {} cycles ({} stalls)>".format(
+            type(self).__name__, self.transfers, self.cycles, self.stalls)
+
+
+class StreamDriver(_StreamStatistics):
+    """Push payloads through a valid/ready handshake
+
+    `payloads` is an iterable (e.g. a list or a NumPy array) of integers
+    that are assigned to `data`, which may be a `Record` (its fields are
+    packed as by `Record.raw_bits`). `valid` is asserted with each payload
+    until a clock edge at which `ready` is asserted; without `ready`,
+    every payload is accepted at the first edge.
+
+    Add the result of `generator` to the testbenches of the clock domain
+    of the stream. `cycles` counts the cycles during which `valid` was
+    asserted, and `stalls` those without `ready`.
+    """
+    def __init__(self, data, valid, ready, payloads):
+        if isinstance(data, Record):
+            data = data.raw_bits()
+        self.data = data
+        self.valid = valid
+        self.ready = ready
+        self.payloads = _payload_list(payloads)
+        self._reset_statistics()
+
+    @classmethod
+    def for_fifo(cls, fifo, payloads):
+        """Write `payloads` into the input interface of `fifo`"""
+        return cls(fifo.din, fifo.we, fifo.writable, payloads)
+
+    def generator(self):
+        data, valid, ready = self.data, self.valid, self.ready
+        for payload in self.payloads:
+            yield [data.eq(payload), valid.eq(1)]
+            yield
+            self.cycles += 1
+            if ready is not None:
+                while not (yield ready):
+                    self.stalls += 1
+                    yield
+                    self.cycles += 1
+            self.transfers += 1
+        yield valid.eq(0)
+
+
+class StreamMonitor(_StreamStatistics):
+    """Collect the payloads of a valid/ready handshake
+
+    The value of `data` (which may be a `Record`) is recorded at each
+    clock edge at which `valid` and `ready` are asserted. With
+    `drive_ready`, the monitor asserts `ready` itself, e.g. to drain the
+    output of a FIFO; without `ready`, `valid` alone marks transfers.
+
+    With `count`, the monitor stops after `count` transfers, and
+    `results` is a NumPy array of that size, preallocated with the given
+    `dtype` (by default, 64-bit unsigned integers, or Python integers for
+    wider data). Otherwise, the monitor is passive and `results` is a
+    list.
+
+    `cycles` counts the cycles until the last transfer, and `stalls` those
+    during which `valid` was asserted without `ready`.
+    """
+    def __init__(self, data, valid, ready=None, drive_ready=False,
+                 count=None, dtype=None):
+        if isinstance(data, Record):
+            data = data.raw_bits()
+        if drive_ready and ready is None:
+            raise ValueError("Cannot drive a missing ready signal")
+        self.data = data
+        self.valid = valid
+        self.ready = ready
+        self.drive_ready = drive_ready
+        self.count = count
+        if count is None:
+            self.results = []
+        else:
+            import numpy as np
+            if dtype is None:
+                dtype = np.uint64 if len(data) <= 64 else object
+            self.results = np.zeros(count, dtype=dtype)
+        self._reset_statistics()
+
+    @classmethod
+    def for_fifo(cls, fifo, count=None, dtype=None):
+        """Read from the output interface of `fifo`, which must be in
+        first-word fall-through mode"""
+        return cls(fifo.dout, fifo.readable, fifo.re, drive_ready=True,
+                   count=count, dtype=dtype)
+
+    def generator(self):
+        data, valid, ready = self.data, self.valid, self.ready
+        count = self.count
+        if count is None:
+            yield "passive"
+            append = self.results.append
+        else:
+            results = self.results
+        if self.drive_ready:
+            yield ready.eq(1)
+            yield
+        request = [valid, data] if ready is None else [valid, data, ready]
+        cycles = 0
+        while count is None or self.transfers < count:
+            # one request per cycle
+            values = yield request
+            yield
+            cycles += 1
+            if values[0]:
+                if ready is None or values[2]:
+                    if count is None:
+                        append(values[1])
+                    else:
+                        results[self.transfers] = values[1]
+                    self.transfers += 1
+                    self.cycles = cycles
+                else:
+                    self.stalls += 1
+        if self.drive_ready:
+            yield ready.eq(0)
@@ -1,8 +1,7 @@
 from itertools import count
-import tempfile
-import os
-from collections import OrderedDict
-import shutil
+from fnmatch import fnmatchcase
+import gzip
+import io
 
 from migen.fhdl.namer import build_namespace
 
@@ -18,84 +17,152 @@ def vcd_codes():
         yield code
 
 
+def _open(filename):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wt", compresslevel=6, encoding="ascii")
+    elif filename.endswith(".zst"):
+        import zstandard
+        raw = open(filename, "wb")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw),
+                                encoding="ascii")
+    elif filename.endswith(".fst"):
+        raise ValueError("FST output is not supported, write a VCD file and"
+                         " convert it with vcd2fst")
+    else:
+        return open(filename, "w", encoding="ascii")
+
+
+def _value_formatter(signal, code):
+    if hasattr(signal, "_enumeration"):
+        values = dict()
+        for value, name in signal._enumeration.items():
+            values[value] = "b{} {}\n".format(
+                "".join("{:08b}".format(c) for c in name.encode()), code)
+        size = max(len(name) for name in signal._enumeration.values()) * 8
+        return size, values.__getitem__
+    nbits = len(signal)
+    mask = 2**nbits - 1
+    if nbits > 1:
+        fmt = ("b{:0" + str(nbits) + "b} " + code + "\n").format
+    else:
+        fmt = ("{}" + code + "\n").format
+    return nbits, lambda value: fmt(value & mask)
+
+
 class VCDWriter:
-    def __init__(self, filename):
+    """Stream value changes of a fixed set of signals to a VCD file
+
+    The header is written when the writer is created. Changes are
+    collected in a list of lines and written in chunks of
+    `buffer_lines`. Files whose name ends with ``.gz`` or ``.zst`` are
+    compressed with gzip or Zstandard (the latter needs the
+    ``zstandard`` package).
+
+    Only the signals whose names match one of the shell-style `patterns`
+    are traced, if given. Changes are recorded from time `start` until
+    time `stop`, and only while the writer is `enabled`; outside of that,
+    tracing is suspended with ``$dumpoff``.
+    """
+    def __init__(self, filename, signals, patterns=None, start=0, stop=None,
+                 enabled=True, buffer_lines=8192):
         self.filename = filename
-        self.buffer_file = tempfile.TemporaryFile(
-            dir=os.path.dirname(filename), mode="w+")
-        self.codegen = vcd_codes()
-        self.codes = OrderedDict()
+        self.file = _open(filename)
+        self.buffer_lines = buffer_lines
+        self.formatters = dict()
+        self.unknown_values = dict()
         self.signal_values = dict()
         self.t = 0
-
-    def _get_code(self, signal):
-        try:
-            code = self.codes[signal]
-        except KeyError:
-            code = next(self.codegen)
-            self.codes[signal] = code
-        return code
-
-    def _write_primitive_value(self, f, signal, value):
-        l = len(signal)
-        if value < 0:
-            value += 2**l
-        if l > 1:
-            fmtstr = "b{:0" + str(l) + "b} {}\n"
-        else:
-            fmtstr = "{}{}\n"
-        code = self._get_code(signal)
-        f.write(fmtstr.format(value, code))
-
-    def _write_enum_value(self, f, signal, value):
-        val = "b"
-        for c in signal._enumeration[value].encode():
-            val += "{:08b}".format(c)
-        code = self._get_code(signal)
-        f.write("{} {}\n".format(val, code))
-
-    def _write_value(self, f, signal, value):
-        if hasattr(signal, "_enumeration"):
-            self._write_enum_value(self.buffer_file, signal, value)
+        self.start = start
+        self.stop = stop
+        self.enabled = enabled
+        self.recording = True
+        self.time_written = True
+        self.buffer = []
+
+        ns = build_namespace(signals)
+        names = [(signal, ns.get_name(signal)) for signal in signals]
+        if patterns is not None:
+            names = [(signal, name) for signal, name in names
+                     if any(fnmatchcase(name, p) for p in patterns)]
+        self.traced = [signal for signal, name in names]
+        header = []
+        for (signal, name), code in zip(names, vcd_codes()):
+            size, formatter = _value_formatter(signal, code)
+            self.formatters[signal] = formatter
+            self.unknown_values[signal] = ("x" if size == 1 else "bx ") \
+                + code + "\n"
+            self.signal_values[signal] = signal.reset.value
+            header.append("$var wire {size} {code} {name} $end\n".format(
+                name=name, code=code, size=size))
+        header.append("$dumpvars\n")
+        for signal in self.traced:
+            header.append(self.formatters[signal](signal.reset.value))
+        header.append("$end\n#0\n")
+        self.file.write("".join(header))
+        self._update()
+
+    def _write_time(self):
+        if not self.time_written:
+            self.buffer.append("#{}\n".format(self.t))
+            self.time_written = True
+
+    def _update(self):
+        recording = (self.enabled and self.start <= self.t
+                     and (self.stop is None or self.t < self.stop))
+        if recording == self.recording:
+            return
+        self.recording = recording
+        self._write_time()
+        if recording:
+            self.buffer.append("$dumpon\n")
+            for signal in self.traced:
+                self.buffer.append(
+                    self.formatters[signal](self.signal_values[signal]))
         else:
-            self._write_primitive_value(self.buffer_file, signal, value)
+            self.buffer.append("$dumpoff\n")
+            for signal in self.traced:
+                self.buffer.append(self.unknown_values[signal])
+        self.buffer.append("$end\n")
+
+    def enable(self):
+        self.enabled = True
+        self._update()
 
     def set(self, signal, value):
-        if (signal not in self.signal_values or
-                self.signal_values[signal] != value):
-            self._write_value(self.buffer_file, signal, value)
+        try:
+            changed = self.signal_values[signal] != value
+        except KeyError:
+            # not traced
+            return
+        if changed:
             self.signal_values[signal] = value
+            if self.recording:
+                self._write_time()
+                self.buffer.append(self.formatters[signal](value))
+                if len(self.buffer) >= self.buffer_lines:
+                    self.flush()
 
     def delay(self, delay):
         self.t += delay
-        self.buffer_file.write("#{}\n".format(self.t))
+        self.time_written = False
+        self._update()
+
+    def flush(self):
+        self.file.write("".join(self.buffer))
+        self.buffer.clear()
 
     def close(self):
-        out = open(self.filename, "w")
-        try:
-            ns = build_namespace(self.codes.keys())
-            for signal, code in self.codes.items():
-                name = ns.get_name(signal)
-                if hasattr(signal, "_enumeration"):
-                    size = max([len(v) for v in signal._enumeration.values()]) * 8
-                else:
-                    size = len(signal)
-                out.write("$var wire {size} {code} {name} $end\n"
-                          .format(name=name, code=code, size=size))
-            out.write("$dumpvars\n")
-            for signal in self.codes.keys():
-                self._write_value(out, signal, signal.reset.value)
-            out.write("$end\n")
-            out.write("#0\n")
-
-            self.buffer_file.seek(0)
-            shutil.copyfileobj(self.buffer_file, out)
-            self.buffer_file.close()
-        finally:
-            out.close()
+        if self.recording:
+            # mark the end of the simulation
+            self._write_time()
+        self.flush()
+        self.file.close()
 
 
 class DummyVCDWriter:
+    def enable(self):
+        pass
+
     def set(self, signal, value):
         pass
 
@@ -0,0 +1,379 @@
+import ctypes
+import hashlib
+import inspect
+import os
+import subprocess
+
+from migen.fhdl.structure import *  # noqa
+from migen.fhdl.structure import _Fragment
+from migen.fhdl.specials import _MemoryLocation
+from migen.fhdl import verilog
+from migen.genlib.resetsync import AsyncResetSynchronizer
+from migen.sim.core import (Simulator, Evaluator, DummyAsyncResetSynchronizer,
+                            _Waiter, _truncate)
+
+
+__all__ = ["VerilatorSimulator", "run_verilator_simulation"]
+
+
+_wrapper = r"""
+#include <cstdint>
+#include "verilated.h"
+#include "verilated_vpi.h"
+#include "Vtop.h"
+
+extern "C" {
+
+void *migen_create(void)
+{
+    Vtop *top = new Vtop;
+    top->eval();
+    return top;
+}
+
+void migen_eval(void *top)
+{
+    static_cast<Vtop *>(top)->eval();
+}
+
+void migen_destroy(void *top)
+{
+    static_cast<Vtop *>(top)->final();
+    delete static_cast<Vtop *>(top);
+}
+
+void *migen_handle(const char *name)
+{
+    return vpi_handle_by_name(const_cast<PLI_BYTE8 *>(name), NULL);
+}
+
+void *migen_word(void *memory, int index)
+{
+    return vpi_handle_by_index(static_cast<vpiHandle>(memory), index);
+}
+
+void migen_get(void *handle, uint32_t *words, int n)
+{
+    s_vpi_value v;
+    v.format = vpiVectorVal;
+    vpi_get_value(static_cast<vpiHandle>(handle), &v);
+    for(int i = 0; i < n; i++)
+        words[i] = v.value.vector[i].aval;
+}
+
+void migen_put(void *handle, const uint32_t *words, int n)
+{
+    s_vpi_vecval vector[n];
+    for(int i = 0; i < n; i++) {
+        vector[i].aval = words[i];
+        vector[i].bval = 0;
+    }
+    s_vpi_value v;
+    v.format = vpiVectorVal;
+    v.value.vector = vector;
+    vpi_put_value(static_cast<vpiHandle>(handle), &v, NULL, vpiNoDelay);
+}
+
+}
+"""
+
+
+def _cache_dir():
+    cache = os.environ.get("XDG_CACHE_HOME",
+                           os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache, "migen", "verilator")
+
+
+def _build(source, sources, build_dir, verilator, options):
+    """Build the shared library of a design, unless it is cached
+
+    The library is stored in a subdirectory of `build_dir` named after a
+    hash of everything that goes into it.
+    """
+    h = hashlib.sha256()
+    for part in [source, _wrapper, verilator] + list(options):
+        h.update(part.encode())
+        h.update(b"\0")
+    for filename in sources:
+        with open(filename, "rb") as f:
+            h.update(f.read())
+    directory = os.path.join(build_dir, h.hexdigest()[:16])
+    library = os.path.join(directory, "libmigen_sim.so")
+    if os.path.exists(library):
+        return library
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "top.v"), "w") as f:
+        f.write(source)
+    with open(os.path.join(directory, "wrapper.cpp"), "w") as f:
+        f.write(_wrapper)
+    obj_dir = os.path.join(directory, "obj_dir")
+    if subprocess.call([verilator, "--cc", "--build", "--vpi",
+                        "--public-flat-rw", "-Wno-fatal",
+                        "--top-module", "top", "--Mdir", obj_dir,
+                        "-CFLAGS", "-fPIC", "-MAKEFLAGS", "OPT=-fPIC"]
+                       + list(options)
+                       + [os.path.join(directory, "top.v")]
+                       + list(sources)):
+        raise OSError("Subprocess failed")
+    archives = [os.path.join(obj_dir, "Vtop__ALL.a"),
+                os.path.join(obj_dir, "libverilated.a")]
+    for archive in archives:
+        if not os.path.exists(archive):
+            raise OSError("Verilator did not build {}".format(archive))
+    root = subprocess.check_output([verilator, "--getenv", "VERILATOR_ROOT"],
+                                   universal_newlines=True).strip()
+    # build under a temporary name, so that interrupted builds are not
+    # mistaken for cached ones
+    partial = library + ".tmp"
+    if subprocess.call(["g++", "-shared", "-fPIC", "-O2",
+                        "-I", obj_dir,
+                        "-I", os.path.join(root, "include"),
+                        "-I", os.path.join(root, "include", "vltstd"),
+                        os.path.join(directory, "wrapper.cpp")]
+                       + archives + ["-pthread", "-o", partial]):
+        raise OSError("Subprocess failed")
+    os.replace(partial, library)
+    return library
+
+
+class _Model:
+    def __init__(self, library):
+        lib = ctypes.CDLL(library)
+        lib.migen_create.restype = ctypes.c_void_p
+        lib.migen_eval.argtypes = [ctypes.c_void_p]
+        lib.migen_destroy.argtypes = [ctypes.c_void_p]
+        lib.migen_handle.restype = ctypes.c_void_p
+        lib.migen_handle.argtypes = [ctypes.c_char_p]
+        lib.migen_word.restype = ctypes.c_void_p
+        lib.migen_word.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        lib.migen_get.argtypes = [ctypes.c_void_p,
+                                  ctypes.POINTER(ctypes.c_uint32),
+                                  ctypes.c_int]
+        lib.migen_put.argtypes = [ctypes.c_void_p,
+                                  ctypes.POINTER(ctypes.c_uint32),
+                                  ctypes.c_int]
+        self.lib = lib
+        self.top = lib.migen_create()
+
+    def eval(self):
+        self.lib.migen_eval(self.top)
+
+    def handle(self, name):
+        return self.lib.migen_handle(name.encode())
+
+    def word(self, memory, index):
+        return self.lib.migen_word(memory, index)
+
+    def get(self, handle, nbits):
+        n = (nbits + 31) // 32
+        words = (ctypes.c_uint32 * n)()
+        self.lib.migen_get(handle, words, n)
+        return sum(word << 32 * i for i, word in enumerate(words))
+
+    def put(self, handle, nbits, value):
+        n = (nbits + 31) // 32
+        value &= 2**nbits - 1
+        words = (ctypes.c_uint32 * n)(*[(value >> 32 * i) & 0xffffffff
+                                        for i in range(n)])
+        self.lib.migen_put(handle, words, n)
+
+    def close(self):
+        if self.top is not None:
+            self.lib.migen_destroy(self.top)
+            self.top = None
+
+
+class VerilatorEvaluator(Evaluator):
+    """Evaluator reading and writing the signals of a Verilated model
+
+    Signals and memories of the design are accessed through VPI by their
+    names in the generated Verilog. Writes are buffered until `commit`,
+    like in the Python evaluator. Signals the model does not know about
+    (e.g. signals only used by testbenches) are kept in Python.
+    """
+    def __init__(self, clock_domains, model, ns):
+        super().__init__(clock_domains)
+        self.model = model
+        self.ns = ns
+        self.handles = dict()
+        self.pending_words = []
+        # the slots of `dirty`, for lookups
+        self.dirty_slots = set()
+
+    def _handle(self, obj):
+        try:
+            return self.handles[obj]
+        except KeyError:
+            # only objects named while printing the Verilog are in the
+            # model, in the VPI scope named after the top module
+            if obj in self.ns.sigs:
+                handle = self.model.handle("top." + self.ns.get_name(obj))
+            else:
+                handle = None
+            self.handles[obj] = handle
+            return handle
+
+    def commit(self):
+        model = self.model
+        for slot in self.dirty:
+            signal = self.signals[slot]
+            handle = self._handle(signal)
+            if handle is None:
+                self.values[slot] = self.next_values[slot]
+            else:
+                model.put(handle, signal.nbits, self.next_values[slot])
+        self.dirty.clear()
+        self.dirty_slots.clear()
+        for handle, nbits, value in self.pending_words:
+            model.put(handle, nbits, value)
+        self.pending_words.clear()
+        # the model does not report which signals changed
+        return []
+
+    def eval(self, node, postcommit=False):
+        if isinstance(node, Signal):
+            slot = self.get_slot(node)
+            if postcommit and slot in self.dirty_slots:
+                return self.next_values[slot]
+            handle = self._handle(node)
+            if handle is None:
+                return self.values[slot]
+            return _truncate(self.model.get(handle, node.nbits),
+                             node.nbits, node.signed)
+        elif isinstance(node, _MemoryLocation):
+            memory = node.memory
+            index = self.eval(node.index, postcommit)
+            handle = self._word(memory, index)
+            if postcommit:
+                for word, nbits, value in reversed(self.pending_words):
+                    if word == handle:
+                        return value
+            return self.model.get(handle, memory.width)
+        else:
+            return super().eval(node, postcommit)
+
+    def _word(self, memory, index):
+        if not 0 <= index < memory.depth:
+            raise IndexError("Address {} out of range for memory {}"
+                             .format(index, memory.name_override))
+        handle = self._handle(memory)
+        if handle is None:
+            raise KeyError("Memory {} not found in the model"
+                           .format(memory.name_override))
+        return self.model.word(handle, index)
+
+    def assign(self, node, value):
+        if isinstance(node, _MemoryLocation):
+            memory = node.memory
+            handle = self._word(memory, self.eval(node.index))
+            self.pending_words.append((handle, memory.width,
+                                       value & (2**memory.width - 1)))
+        else:
+            super().assign(node, value)
+            if isinstance(node, Signal):
+                self.dirty_slots.add(self.get_slot(node))
+
+
+def _check_unsupported(kwargs):
+    defaults = inspect.signature(Simulator.__init__).parameters
+    for name, value in sorted(kwargs.items()):
+        try:
+            default = defaults[name].default
+        except KeyError:
+            raise TypeError("Unexpected keyword argument '{}'".format(name))
+        if value != default:
+            raise NotImplementedError(
+                "Option '{}' is not supported by VerilatorSimulator"
+                .format(name))
+
+
+class VerilatorSimulator(Simulator):
+    """Run testbench generators against a design compiled by Verilator
+
+    The design is converted to Verilog, compiled by Verilator and linked
+    into a shared library that is loaded into the Python process. The
+    library is cached in `build_dir` (by default
+    ``~/.cache/migen/verilator``) under a hash of the Verilog source, so
+    only changed designs are rebuilt. `sources` lists the Verilog files
+    defining the modules of `Instance` specials, and `options` are extra
+    command line arguments for Verilator.
+
+    Generators use the same protocol as with `Simulator`: they read values
+    before the clock edge, and their writes take effect with the edge.
+    Internal signals are accessed through VPI, so the model is built with
+    ``--public-flat-rw``, which limits the optimizations Verilator can
+    perform. VCD output, profiling, co-simulation and the other options
+    of `Simulator` that act on the Python model are not supported, and
+    raise `NotImplementedError` if given.
+    """
+    def __init__(self, fragment_or_module, generators, clocks={"sys": 10},
+                 special_overrides={}, sources=(), build_dir=None,
+                 verilator="verilator", options=[], **kwargs):
+        _check_unsupported(kwargs)
+        if isinstance(fragment_or_module, _Fragment):
+            self.fragment = fragment_or_module
+        else:
+            self.fragment = fragment_or_module.get_fragment()
+        self._init_generators(generators, clocks)
+
+        overrides = {AsyncResetSynchronizer: DummyAsyncResetSynchronizer}
+        overrides.update(special_overrides)
+        ios = {self.fragment.clock_domains[cd].clk for cd in self.time.clocks}
+        output = verilog.convert(self.fragment, ios,
+                                 special_overrides=overrides,
+                                 create_clock_domains=False)
+        if build_dir is None:
+            build_dir = _cache_dir()
+        library = _build(output.main_source, sources, build_dir, verilator,
+                         options)
+        self.model = _Model(library)
+        self.evaluator = VerilatorEvaluator(self.fragment.clock_domains,
+                                            self.model, output.ns)
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.model.close()
+
+    def _add_waiter(self, generator, command, value):
+        # The conditions are evaluated at every clock edge, as the model
+        # does not report which signals changed.
+        self._waiting[generator] = _Waiter(command, value, set())
+
+    def run(self):
+        model = self.model
+        clock_domains = self.fragment.clock_domains
+        clocks = {cd: self.evaluator._handle(clock_domains[cd].clk)
+                  for cd in self.time.clocks}
+        for cd, cs in self.time.clocks.items():
+            model.put(clocks[cd], 1, int(cs.high))
+        model.eval()
+
+        while True:
+            dt, rising, falling = self.time.tick()
+            for cd in sorted(rising):
+                self.cycles[cd] += 1
+                if cd in self.generators:
+                    for waiter in self._waiting.values():
+                        waiter.triggered = True
+                    self._process_generators(cd)
+            # The registers sample their inputs at the edge, before the
+            # writes of the generators take effect.
+            for cd in rising:
+                model.put(clocks[cd], 1, 1)
+            for cd in falling:
+                model.put(clocks[cd], 1, 0)
+            model.eval()
+            self.evaluator.commit()
+            model.eval()
+
+            if not self._continue_simulation():
+                break
+
+
+def run_verilator_simulation(*args, **kwargs):
+    """Like `run_simulation`, with a `VerilatorSimulator`"""
+    with VerilatorSimulator(*args, **kwargs) as s:
+        s.run()
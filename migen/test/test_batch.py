@@ -0,0 +1,70 @@
+import unittest
+from random import Random
+
+from migen import *  # noqa
+from migen.sim.batch import Lanes, run_batch_simulation
+from migen.test.test_sim import Kitchensink, _run
+
+
+def _batch_stimulus(dut, traces, seeds, cycles=200):
+    prngs = [Random(seed) for seed in seeds]
+    for cycle in range(cycles):
+        stimulus = [(prng.randrange(256), prng.randrange(-32, 32),
+                     prng.randrange(8), prng.randrange(4)) for prng in prngs]
+        for signal, values in zip((dut.a, dut.b, dut.sel, dut.we),
+                                  zip(*stimulus)):
+            yield signal.eq(Lanes(values))
+        yield
+        outputs = yield dut.outputs
+        words = yield [dut.mem[i] for i in range(dut.mem.depth)]
+        for lane, trace in enumerate(traces):
+            trace.append([int(v[lane]) for v in outputs])
+            trace.append([int(v[lane]) for v in words])
+
+
+class BatchCase(unittest.TestCase):
+    def test_lanes_match_simulator(self):
+        seeds = range(3)
+        traces = [[] for seed in seeds]
+        dut = Kitchensink()
+        run_batch_simulation(dut, _batch_stimulus(dut, traces, seeds),
+                             lanes=len(seeds))
+        for seed, trace in zip(seeds, traces):
+            self.assertEqual(trace, _run(seed, compiled=False))
+
+    def test_broadcast(self):
+        m = Module()
+        a = Signal(8)
+        b = Signal(8)
+        m.sync += b.eq(a + 1)
+
+        def gen():
+            yield a.eq(3)
+            yield
+            yield
+            self.assertEqual(list((yield b)), [4] * 5)
+        run_batch_simulation(m, gen(), lanes=5)
+
+    def test_wait_commands(self):
+        m = Module()
+        step = Signal(4)
+        c = Signal(8)
+        m.sync += c.eq(c + step)
+        cycles = []
+
+        def gen():
+            yield step.eq(Lanes([1, 3]))
+            # 3 in both lanes: c = 3 * step and c = 9 * step
+            yield WaitUntil(c == Lanes([3, 9]))
+            cycles.append((yield c))
+            yield WaitChange(c > 10)
+            cycles.append((yield c))
+        run_batch_simulation(m, gen(), lanes=2)
+        self.assertEqual([list(c) for c in cycles], [[3, 9], [4, 12]])
+
+    def test_too_wide(self):
+        m = Module()
+        a = Signal(64)
+        m.sync += a.eq(a + 1)
+        with self.assertRaises(ValueError):
+            run_batch_simulation(m, [], lanes=2)
@@ -1,3 +1,4 @@
+import pickle
 import unittest
 
 from migen import *  # noqa
@@ -27,3 +28,19 @@ class ConstantCase(SimCase, unittest.TestCase):
                     "got {}, want {} from literal {}".format(
                         s, v, l))
         self.run_with(gen())
+
+
+class HashConsingCase(unittest.TestCase):
+    def test_shared(self):
+        self.assertIs(C(5), C(5))
+        self.assertIs(C(5), C(5, 3))
+        self.assertIs(Signal(8).reset, Signal(8).reset)
+        self.assertIsNot(C(5, 4), C(5))
+        self.assertIsNot(C(5, (3, True)), C(5))
+        self.assertEqual(C(5, 4).nbits, 4)
+
+    def test_pickle(self):
+        c = pickle.loads(pickle.dumps(C(-3, 8)))
+        self.assertIs(c, C(-3, 8))
+        c = pickle.loads(pickle.dumps(C(2**40)))
+        self.assertEqual((c.value, c.nbits, c.signed), (2**40, 41, False))
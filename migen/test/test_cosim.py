@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from migen import *  # noqa
+from migen.sim.cosim import IcarusCosimulation
+
+
+_counter = """
+module counter(input clk, input [7:0] step, output reg [7:0] count,
+               output [7:0] next);
+\tinitial count = 0;
+\tassign next = count + step;
+\talways @(posedge clk)
+\t\tcount <= next;
+endmodule
+"""
+
+
+class CounterDUT(Module):
+    def __init__(self):
+        self.step = Signal(8)
+        self.count = Signal(8)
+        self.next = Signal(8)
+        self.shadow = Signal(8)
+        self.specials += Instance("counter",
+                                  i_clk=ClockSignal(), i_step=self.step,
+                                  o_count=self.count, o_next=self.next)
+        self.sync += self.shadow.eq(self.count)
+
+
+@unittest.skipUnless(shutil.which("iverilog"), "Icarus Verilog not found")
+class IcarusCosimulationCase(unittest.TestCase):
+    def test_counter(self):
+        dut = CounterDUT()
+        counts = []
+
+        def gen():
+            yield dut.step.eq(3)
+            yield
+            for i in range(4):
+                counts.append(((yield dut.count), (yield dut.next),
+                               (yield dut.shadow)))
+                yield
+
+        with tempfile.TemporaryDirectory() as build_dir:
+            source = os.path.join(build_dir, "counter.v")
+            with open(source, "w") as f:
+                f.write(_counter)
+            run_simulation(dut, gen(),
+                           cosim=IcarusCosimulation([source], build_dir))
+        self.assertEqual(counts, [(0, 3, 0), (3, 6, 0), (6, 9, 3),
+                                  (9, 12, 6)])
@@ -0,0 +1,145 @@
+import os
+import tempfile
+import unittest
+
+from migen import *  # noqa
+from migen.fhdl.namer import build_namespace, read_names
+from migen.fhdl.tools import list_signals
+
+
+def _signals(n):
+    return [Signal() for i in range(n)]
+
+
+class _Leaf:
+    def __init__(self):
+        self.sigs = _signals(2)
+        self.x = Signal()
+
+
+class _Node:
+    def __init__(self, n):
+        self.leaves = [_Leaf() for i in range(n)]
+        self.y = Signal()
+
+
+class NamerCase(unittest.TestCase):
+    def test_hierarchy(self):
+        nodes = [_Node(2) for i in range(2)]
+        signals = [nodes[0].y, nodes[1].y]
+        for node in nodes:
+            for leaf in node.leaves:
+                signals += leaf.sigs + [leaf.x]
+        ns = build_namespace(signals)
+        names = [ns.get_name(s) for s in signals]
+        self.assertEqual(len(set(names)), len(names))
+        self.assertEqual(names[:2], ["node0_y", "node1_y"])
+        self.assertEqual(names[2:5], ["node0_leaf0_sigs0", "node0_leaf0_sigs1",
+                                      "node0_leaf0_x"])
+        # leaves are numbered among all the leaves
+        self.assertEqual(names[-1], "node1_leaf3_x")
+
+    def test_fan_out(self):
+        leaves = [_Leaf() for i in range(300)]
+        signals = [s for leaf in leaves for s in (leaf.x, leaf.sigs[1])]
+        ns = build_namespace(signals)
+        expected = []
+        for i in range(300):
+            expected += ["leaf{}_x".format(i), "leaf{}_sigs".format(i)]
+        self.assertEqual([ns.get_name(s) for s in signals], expected)
+
+
+class _Counter(Module):
+    def __init__(self):
+        self.a = Signal(8)
+        self.sync += self.a.eq(self.a + 1)
+
+
+class _Top(Module):
+    def __init__(self, named=(), anonymous=0):
+        self.x = Signal(8)
+        self.counters = dict()
+        for name in named:
+            counter = _Counter()
+            setattr(self.submodules, name, counter)
+            self.counters[name] = counter
+        self.anonymous = []
+        for i in range(anonymous):
+            counter = _Counter()
+            self.submodules += counter
+            self.anonymous.append(counter)
+        self.comb += self.x.eq(sum(c.a for c in self.counters.values())
+                               + sum(c.a for c in self.anonymous))
+
+
+def _namespace(top, names=None):
+    signals = list_signals(top.get_fragment())
+    ns = build_namespace(signals, names=names, top=top)
+    for signal in sorted(signals, key=hash):
+        ns.get_name(signal)
+    return ns
+
+
+class SeededNamerCase(unittest.TestCase):
+    def _counter_names(self, top, ns):
+        return {name: ns.get_name(c.a) for name, c in top.counters.items()}
+
+    def test_insert_remove(self):
+        top = _Top(["b", "c"])
+        ns = _namespace(top)
+        expected = self._counter_names(top, ns)
+        names = ns.names()
+        self.assertEqual(len(names), 3)
+
+        top = _Top(["a", "b", "c"])
+        # without names, the new counter takes the name of another one
+        unseeded = self._counter_names(top, _namespace(top))
+        self.assertNotEqual(unseeded["b"], expected["b"])
+        top = _Top(["a", "b", "c"])
+        r = self._counter_names(top, _namespace(top, names))
+        self.assertEqual(r["b"], expected["b"])
+        self.assertEqual(r["c"], expected["c"])
+        self.assertNotIn(r["a"], expected.values())
+
+        top = _Top(["c"])
+        r = self._counter_names(top, _namespace(top, names))
+        self.assertEqual(r["c"], expected["c"])
+
+    def test_ambiguous(self):
+        top = _Top(["b"], anonymous=2)
+        ns = _namespace(top)
+        names = ns.names()
+        # anonymous counters of the same class cannot be told apart
+        self.assertEqual(sorted(names.values()),
+                         sorted([ns.get_name(top.x),
+                                 ns.get_name(top.counters["b"].a)]))
+        top = _Top(["b"], anonymous=3)
+        ns = _namespace(top, names)
+        self.assertEqual(ns.fixed, {top.x: names[":x#0"],
+                                    top.counters["b"].a: names["b:a#0"]})
+
+    def test_round_trip(self):
+        top = _Top(["b", "c"], anonymous=1)
+        ns = _namespace(top)
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "names.json")
+            ns.write_names(filename)
+            names = read_names(filename)
+        self.assertEqual(names, ns.names())
+        self.assertEqual(len(names), 4)
+        top = _Top(["b", "c"], anonymous=1)
+        seeded = _namespace(top, names)
+        self.assertEqual(seeded.names(), names)
+
+    def test_override(self):
+        top = _Top(["b"])
+        ns = _namespace(top)
+        names = ns.names()
+        top = _Top(["b"])
+        port = Signal(name_override=names[":x#0"])
+        top.comb += port.eq(top.x[0])
+        ns = _namespace(top, names)
+        # the new port keeps its name, the signal that had it is renamed
+        self.assertEqual(ns.get_name(port), names[":x#0"])
+        self.assertNotEqual(ns.get_name(top.x), names[":x#0"])
+        self.assertEqual(ns.get_name(top.counters["b"].a), names["b:a#0"])
@@ -0,0 +1,42 @@
+import io
+import unittest
+
+from migen import *  # noqa
+from migen.sim.runner import SimulationJob, run_regression, print_report
+
+
+class _Counter(Module):
+    def __init__(self):
+        self.count = Signal(8)
+        self.sync += self.count.eq(self.count + 1)
+
+
+def _count_to_5(dut):
+    for i in range(5):
+        yield
+    assert (yield dut.count) == 5
+
+
+def _fail(dut):
+    yield
+    assert (yield dut.count) == 42
+
+
+class RunnerCase(unittest.TestCase):
+    def test_regression(self):
+        jobs = [
+            SimulationJob(_Counter, _count_to_5),
+            SimulationJob(_Counter, _fail, name="fail"),
+            SimulationJob(_Counter, _count_to_5, clocks={"sys": 4},
+                          compiled=False)
+        ]
+        for processes in 1, 2:
+            results = run_regression(jobs, processes=processes)
+            self.assertEqual([r.passed for r in results], [True, False, True])
+            self.assertEqual(results[0].name, "_Counter")
+            self.assertEqual(results[0].cycles, {"sys": 6})
+            self.assertIn("AssertionError", results[1].error)
+
+            report = io.StringIO()
+            self.assertFalse(print_report(results, report))
+            self.assertIn("2 passed, 1 failed", report.getvalue())
@@ -0,0 +1,598 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from random import Random
+
+from migen import *  # noqa
+from migen.genlib.fsm import FSM, NextState, NextValue
+
+
+class Kitchensink(Module):
+    def __init__(self):
+        self.a = Signal(8)
+        self.b = Signal((6, True))
+        self.sel = Signal(3)
+        self.we = Signal(2)
+
+        self.outputs = outputs = []
+
+        def out(*args, **kwargs):
+            s = Signal(*args, **kwargs)
+            outputs.append(s)
+            return s
+
+        # arithmetic, signedness and operators
+        x = out((10, True))
+        self.comb += x.eq(self.a * self.b - (self.a >> 2) + (self.b << 1))
+        y = out(4)
+        self.comb += y.eq(Mux(self.a > self.b, ~self.a, Replicate(self.sel[0], 4)))
+        p = out(3)
+        self.comb += p.eq(Cat(self.a, self.b).part(self.sel + 4, 3))
+        z = out(16)
+        self.comb += z.eq(Cat(self.a[2:6], self.b[::-1], self.a == 3,
+                              self.b >= -2, self.b != 5))
+
+        # slices, parts and concatenations as assignment targets
+        r = out(16, reset=0x1234)
+        self.sync += [
+            r[4:8].eq(self.a),
+            r.part(self.sel, 3).eq(self.b),
+            Cat(r[12:], r[0]).eq(self.a + 1)
+        ]
+        c = out(12)
+        self.comb += [
+            c.eq(0x5a5),
+            c.part(self.sel[:2] * 3, 4).eq(0)
+        ]
+
+        # arrays on both sides
+        regs = Array(out(5, reset=i) for i in range(5))
+        mixed = Array([out(3), out((4, True)), self.a[:2]])
+        self.sync += [
+            regs[self.sel].eq(regs[self.a[:3]] + self.b),
+            mixed[self.sel[1:]].eq(regs[self.sel] - 7)
+        ]
+        ao = out(8)
+        self.comb += ao.eq(Array([self.a, self.b, x[1:9], 42])[self.sel])
+
+        # case statements
+        cs = out((5, True), reset=-3)
+        self.sync += Case(self.sel, {
+            0: cs.eq(cs + 1),
+            1: cs.eq(self.b),
+            5: [cs.eq(-1), If(self.a[0], cs.eq(3)).Elif(self.a[1], cs.eq(4))],
+            "default": cs.eq(cs)
+        })
+        cs2 = out(2)
+        self.comb += Case(self.b, {-1: cs2.eq(1), 3: cs2.eq(2)})
+
+        # state machine
+        counter = out(4)
+        self.submodules.fsm = fsm = FSM()
+        fsm.act(
+            "IDLE",
+            If(self.a[7], NextState("COUNT"))
+        )
+        fsm.act(
+            "COUNT",
+            NextValue(counter, counter + 1),
+            If(counter == 9, NextState("DONE"))
+        )
+        fsm.act(
+            "DONE",
+            NextValue(counter, 0),
+            NextState("IDLE")
+        )
+        st = out(2)
+        self.comb += st.eq(Cat(fsm.ongoing("COUNT"), fsm.ongoing("DONE")))
+
+        # memories
+        mem = Memory(16, 24, init=[(i * 0x1357) & 0xffff for i in range(10)])
+        self.specials += mem
+        for mode in READ_FIRST, WRITE_FIRST, NO_CHANGE:
+            port = mem.get_port(write_capable=True, we_granularity=8,
+                                mode=mode)
+            self.specials += port
+            self.comb += [
+                port.adr.eq(self.a[:4] + mode),
+                port.dat_w.eq(self.a * (mode + 1) + x),
+                port.we.eq(self.we)
+            ]
+            outputs.append(port.dat_r)
+        port = mem.get_port(async_read=True, has_re=True)
+        self.specials += port
+        self.comb += port.adr.eq(self.sel + 10)
+        outputs.append(port.dat_r)
+        self.mem = mem
+
+
+def _stimulus(dut, trace, seed, cycles=200):
+    prng = Random(seed)
+    for cycle in range(cycles):
+        yield dut.a.eq(prng.randrange(256))
+        yield dut.b.eq(prng.randrange(-32, 32))
+        yield dut.sel.eq(prng.randrange(8))
+        yield dut.we.eq(prng.randrange(4))
+        yield
+        trace.append((yield dut.outputs))
+        trace.append((yield [dut.mem[i] for i in range(dut.mem.depth)]))
+
+
+def _run(seed, **kwargs):
+    trace = []
+    dut = Kitchensink()
+    run_simulation(dut, _stimulus(dut, trace, seed), **kwargs)
+    return trace
+
+
+class ProfileCase(unittest.TestCase):
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as d:
+            trace = []
+            dut = Kitchensink()
+            with contextlib.redirect_stdout(io.StringIO()) as report:
+                run_simulation(dut, _stimulus(dut, trace, 0),
+                               vcd_name=os.path.join(d, "k.vcd"),
+                               profile=os.path.join(d, "profile.json"))
+            with open(os.path.join(d, "profile.json")) as f:
+                profile = json.load(f)
+        self.assertEqual(trace, _run(0))
+        self.assertIn("_stimulus", report.getvalue())
+        entries = {(e["category"], e["name"]): e for e in profile["entries"]}
+        # one count per resumption of the generator
+        self.assertEqual(entries[("generator", "_stimulus")]["count"],
+                         200 * 7 + 1)
+        self.assertEqual(entries[("sync", "memory mem")]["count"], 6 * 201)
+        self.assertIn("vcd", {category for category, name in entries})
+        comb = [e for e in profile["entries"] if e["category"] == "comb"]
+        self.assertTrue(any(e["module"].endswith("kitchensink.fsm")
+                            for e in comb))
+        self.assertIn("", profile["modules"])
+
+
+class CompiledCase(unittest.TestCase):
+    def test_matches_interpreter(self):
+        for seed in range(3):
+            self.assertEqual(_run(seed, compiled=True),
+                             _run(seed, compiled=False))
+
+    def test_wide_slices(self):
+        def run(compiled):
+            m = Module()
+            bus = Signal(512)
+            offset = Signal(9)
+            part = Signal(64)
+            rep = Signal(512)
+            out = Signal(512)
+            m.comb += [
+                part.eq(bus.part(offset, 64)),
+                rep.eq(Replicate(bus[100:132], 16)),
+            ]
+            m.sync += [
+                out[3:67].eq(part),
+                out.part(offset, 17).eq(bus[-17:]),
+                out[400:].eq(rep[5:]),
+            ]
+            trace = []
+
+            def gen():
+                prng = Random(0)
+                for i in range(50):
+                    yield bus.eq(prng.getrandbits(512))
+                    yield offset.eq(prng.randrange(512 - 64))
+                    yield
+                    trace.append(((yield part), (yield rep), (yield out)))
+            run_simulation(m, gen(), compiled=compiled)
+            return trace
+        trace = run(False)
+        self.assertEqual(trace, run(True))
+        self.assertNotEqual(trace[-1][2], 0)
+
+    def test_case_tables(self):
+        def run(compiled):
+            m = Module()
+            sel = Signal(5)
+            sub = Signal((4, True))
+            x = Signal(8)
+            y = Signal(8)
+            inner = {v: y.eq(v * 3) for v in range(-8, 8)}
+            cases = {v: x.eq(v + 1) for v in range(20)}
+            cases[3] = [x.eq(100), Case(sub, inner)]
+            cases[4] = []
+            cases[24] = Case(sub, dict(inner, default=y.eq(0)))
+            m.comb += Case(sel, dict(cases, default=x.eq(200)))
+            m.sync += Case(sel, {v: y.eq(v) for v in range(2, 12)})
+            trace = []
+
+            def gen():
+                for i in range(64):
+                    yield sel.eq(i * 7)
+                    yield sub.eq(i * 5)
+                    yield
+                    trace.append(((yield x), (yield y)))
+            run_simulation(m, gen(), compiled=compiled)
+            return trace
+        self.assertEqual(run(True), run(False))
+
+    def test_nested_arrays(self):
+        def run(compiled):
+            m = Module()
+            rows = [[Signal(16, reset=16 * i + j) for j in range(4)]
+                    for i in range(3)]
+            i = Signal(2)
+            j = Signal(2)
+            x = Signal(8)
+            y = Signal(8)
+            m.comb += [
+                x.eq(Array(Array(s[0:8] for s in row)
+                           for row in rows)[i][j]),
+                y.eq(Array([Array([rows[0][1] + 1, rows[1][2][4:]])[j[0]],
+                            rows[2][3] >> 1])[i[0]]),
+            ]
+            trace = []
+
+            def gen():
+                for k in range(16):
+                    yield i.eq(k >> 2)
+                    yield j.eq(k & 3)
+                    yield
+                    trace.append(((yield x), (yield y)))
+            run_simulation(m, gen(), compiled=compiled)
+            return trace
+        trace = run(False)
+        self.assertEqual(trace[6], (18, 17))
+        self.assertEqual(run(True), trace)
+
+
+class CombPropagationCase(unittest.TestCase):
+    def test_chain_settles(self):
+        m = Module()
+        chain = [Signal(8) for _ in range(6)]
+        m.comb += [b.eq(a + 1) for a, b in zip(chain, chain[1:])]
+        written = Signal(8)
+        m.comb += written.eq(chain[-1])
+
+        def gen():
+            for i in range(10):
+                yield chain[0].eq(i)
+                yield
+                self.assertEqual((yield chain[-1]), i + 5)
+                # writes to comb driven signals do not stick
+                yield written.eq(0)
+                yield
+                self.assertEqual((yield written), i + 5)
+        run_simulation(m, gen())
+
+    def test_indices_are_inputs(self):
+        m = Module()
+        sel = Signal(2)
+        target = Signal(8)
+        regs = Array(Signal(2) for _ in range(4))
+        m.comb += [
+            target.eq(0),
+            target.part(sel, 2).eq(3),
+            regs[sel].eq(sel)
+        ]
+
+        def gen():
+            for i in range(4):
+                yield sel.eq(i)
+                yield
+                self.assertEqual((yield target), 3 << i)
+                self.assertEqual((yield regs[i]), i)
+        run_simulation(m, gen())
+
+    def test_loop(self):
+        m = Module()
+        x, y = Signal(), Signal()
+        loop_a = Signal()
+        loop_b = Signal()
+        m.comb += [
+            loop_a.eq(loop_b | x),
+            loop_b.eq(loop_a & y)
+        ]
+
+        def gen():
+            yield y.eq(1)
+            yield x.eq(1)
+            yield
+            self.assertEqual((yield loop_a), 1)
+            yield x.eq(0)
+            yield
+            self.assertEqual((yield loop_a), 1)
+            yield y.eq(0)
+            yield
+            self.assertEqual((yield [loop_a, loop_b]), [0, 0])
+        with self.assertLogs(level="WARNING") as logs:
+            run_simulation(m, gen())
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("_loop_a, combpropagationcase_loop_b", logs.output[0])
+
+    def test_no_false_loop(self):
+        m = Module()
+        c, x, a, b = Signal(), Signal(), Signal(), Signal()
+        m.comb += If(c, a.eq(x), b.eq(a))
+
+        def gen():
+            yield c.eq(1)
+            yield x.eq(1)
+            yield
+            self.assertEqual((yield b), 1)
+        with self.assertRaises(AssertionError):
+            with self.assertLogs(level="WARNING"):
+                run_simulation(m, gen())
+
+
+class MemoryCase(unittest.TestCase):
+    def _async_read_follows_writes(self, compiled):
+        m = Module()
+        mem = Memory(8, 2**16)
+        port = mem.get_port(async_read=True)
+        m.specials += mem, port
+        doubled = Signal(9)
+        m.comb += doubled.eq(port.dat_r << 1)
+
+        def gen():
+            yield port.adr.eq(1234)
+            yield
+            self.assertEqual((yield doubled), 0)
+            yield mem[1234].eq(21)
+            yield
+            self.assertEqual((yield port.dat_r), 21)
+            self.assertEqual((yield doubled), 42)
+        run_simulation(m, gen(), compiled=compiled)
+
+    def test_async_read_follows_writes(self):
+        self._async_read_follows_writes(True)
+        self._async_read_follows_writes(False)
+
+    def test_out_of_range_write(self):
+        m = Module()
+        mem = Memory(8, 4)
+        m.specials += mem
+
+        def gen():
+            yield mem[4].eq(1)
+        with self.assertRaises(IndexError):
+            run_simulation(m, gen())
+
+
+def _stimulus_window(dut, trace, start, stop):
+    for cycle in range(start, stop):
+        prng = Random(cycle)
+        yield dut.a.eq(prng.randrange(256))
+        yield dut.b.eq(prng.randrange(-32, 32))
+        yield dut.sel.eq(prng.randrange(8))
+        yield dut.we.eq(prng.randrange(4))
+        yield
+        trace.append((yield dut.outputs))
+        trace.append((yield [dut.mem[i] for i in range(dut.mem.depth)]))
+
+
+class CheckpointCase(unittest.TestCase):
+    def _checkpoint(self, compiled):
+        expected = []
+        dut = Kitchensink()
+
+        def continuous():
+            yield from _stimulus_window(dut, [], 0, 50)
+            # the restored simulation starts on the next cycle
+            yield
+            yield from _stimulus_window(dut, expected, 50, 100)
+        run_simulation(dut, continuous(), compiled=compiled)
+
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "checkpoint")
+            dut = Kitchensink()
+            with Simulator(dut, _stimulus_window(dut, [], 0, 50),
+                           compiled=compiled) as sim:
+                sim.run()
+                sim.save(filename)
+
+            trace = []
+            dut = Kitchensink()
+            with Simulator(dut, _stimulus_window(dut, trace, 50, 100),
+                           compiled=compiled) as sim:
+                sim.restore(filename)
+                sim.run()
+            self.assertEqual(trace, expected)
+            self.assertEqual(sim.cycles["sys"], 102)
+
+            with Simulator(Module(), []) as sim:
+                with self.assertRaises(ValueError):
+                    sim.restore(filename)
+
+    def test_checkpoint(self):
+        self._checkpoint(True)
+        self._checkpoint(False)
+
+
+class WaitCyclesCase(unittest.TestCase):
+    def _counter(self):
+        m = Module()
+        m.count = Signal(8)
+        m.sync += If(m.count != 200, m.count.eq(m.count + 1))
+        return m
+
+    def test_same_as_yields(self):
+        log = []
+
+        def gen(m, wait):
+            for i in range(5):
+                log.append((yield m.count))
+                if wait:
+                    yield WaitCycles(i)
+                else:
+                    for j in range(i):
+                        yield
+        for wait in False, True:
+            m = self._counter()
+            run_simulation(m, gen(m, wait))
+        self.assertEqual(log[:5], log[5:])
+
+    def test_skip_idle(self):
+        m = self._counter()
+
+        def gen():
+            yield WaitCycles(10**7)
+            self.assertEqual((yield m.count), 200)
+            yield m.count.eq(3)
+            yield
+            yield
+            self.assertEqual((yield m.count), 4)
+        with Simulator(m, gen()) as sim:
+            sim.run()
+        self.assertEqual(sim.cycles["sys"], 10**7 + 3)
+        self.assertEqual(sim.time.now, (10**7 + 3) * 10 - 5)
+
+
+class WaitConditionCase(unittest.TestCase):
+    def _run(self, wait):
+        m = Module()
+        count = Signal(10)
+        slow = Signal()
+        m.sync += count.eq(count + 1)
+        m.comb += slow.eq(count[4])
+        flag = Signal()
+        log = []
+
+        def waiter():
+            if wait:
+                yield WaitUntil(count == 100)
+            else:
+                while not (yield count == 100):
+                    yield
+            log.append(("until", (yield count)))
+            for i in range(3):
+                if wait:
+                    yield WaitChange(slow)
+                else:
+                    value = yield slow
+                    while (yield slow) == value:
+                        yield
+                log.append(("change", (yield count), (yield slow)))
+            if wait:
+                yield WaitUntil(flag)
+            else:
+                while not (yield flag):
+                    yield
+            log.append(("flag", (yield count)))
+
+        def setter():
+            yield WaitCycles(300)
+            yield flag.eq(1)
+        run_simulation(m, [waiter(), setter()])
+        return log
+
+    def test_same_as_polling(self):
+        log = self._run(True)
+        self.assertEqual(log, self._run(False))
+        self.assertEqual(log[0], ("until", 100))
+        self.assertEqual(log[-1], ("flag", 301))
+
+
+class AsyncCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def _counter(self):
+        m = Module()
+        m.count = Signal(8)
+        m.load = Signal(8)
+        m.we = Signal()
+        m.sync += If(m.we, m.count.eq(m.load)).Else(m.count.eq(m.count + 1))
+        return m
+
+    def test_coroutine_testbench(self):
+        def gen(m, log):
+            yield m.count.eq(10)
+            yield
+            log.append((yield m.count))
+            yield WaitCycles(3)
+            log.append((yield m.count))
+            yield WaitUntil(m.count == 20)
+            log.append((yield m.count))
+
+        async def coroutine(m, log):
+            await Yield(m.count.eq(10))
+            await Yield()
+            log.append(await Yield(m.count))
+            await WaitCycles(3)
+            log.append(await Yield(m.count))
+            await WaitUntil(m.count == 20)
+            log.append(await Yield(m.count))
+
+        logs = []
+        for testbench in gen, coroutine:
+            m = self._counter()
+            logs.append([])
+            run_simulation(m, testbench(m, logs[-1]))
+        self.assertEqual(logs[0], [10, 13, 20])
+        self.assertEqual(logs[0], logs[1])
+
+    def test_await_futures(self):
+        m = self._counter()
+        queue = asyncio.Queue()
+        log = []
+
+        async def producer():
+            for value in 5, 50, None:
+                await asyncio.sleep(0.01)
+                await queue.put(value)
+
+        async def consumer():
+            while True:
+                value = await queue.get()
+                if value is None:
+                    break
+                await Yield([m.load.eq(value), m.we.eq(1)])
+                await Yield()
+                await Yield(m.we.eq(0))
+                await Yield()
+                log.append(await Yield(m.count))
+            future = self.loop.create_future()
+            self.loop.call_soon(future.set_exception, ValueError("failed"))
+            with self.assertRaises(ValueError):
+                await future
+
+        with Simulator(m, consumer()) as sim:
+            self.loop.run_until_complete(asyncio.gather(
+                producer(), sim.run_async()))
+        self.assertEqual(log, [5, 50])
+        # time does not advance while the testbench waits
+        self.assertEqual(sim.cycles["sys"], 9)
+
+    def test_run_rejects_futures(self):
+        m = self._counter()
+
+        async def coroutine():
+            await self.loop.create_future()
+        with Simulator(m, coroutine()) as sim:
+            with self.assertRaises(RuntimeError):
+                sim.run()
+
+    def test_step(self):
+        m = self._counter()
+
+        async def drive(sim):
+            sim.write(m.load, 100)
+            sim.write(m.we, 1)
+            await sim.step()
+            self.assertEqual(sim.read(m.count), 100)
+            sim.write(m.we, 0)
+            await sim.step(5)
+            self.assertEqual(sim.read(m.count), 105)
+            self.assertEqual(sim.read(m.count + 1), 106)
+
+        with Simulator(m, []) as sim:
+            self.loop.run_until_complete(drive(sim))
+        self.assertEqual(sim.cycles["sys"], 6)
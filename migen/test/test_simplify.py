@@ -0,0 +1,144 @@
+import unittest
+
+from migen import *  # noqa
+from migen.fhdl import verilog
+from migen.fhdl.tools import fold_constants, remove_dead_logic
+from migen.test.test_sim import Kitchensink, _stimulus, _run
+
+
+class FoldConstantsCase(unittest.TestCase):
+    def _fold(self, statements):
+        m = Module()
+        m.comb += statements
+        return fold_constants(m.get_fragment()).comb
+
+    def test_expressions(self):
+        x = Signal(8)
+        s = Signal((8, True))
+        comb = self._fold([
+            x.eq(C(3, 4) + C(5, 4)),
+            x.eq(Cat(C(1, 1), C(2, 2))[1:3]),
+            x.eq(Replicate(C(2, 2), 3)),
+            s.eq(-C(3, 2)),
+            # would not fit in 4 unsigned bits
+            x.eq(~C(3, 4)),
+        ])
+        values = [(s.r.value, s.r.nbits, s.r.signed) for s in comb[:4]]
+        self.assertEqual(values, [(8, 5, False), (2, 2, False),
+                                  (42, 6, False), (-3, 3, True)])
+        self.assertNotIsInstance(comb[4].r, Constant)
+
+    def test_control_flow(self):
+        a = Signal(8)
+        b = Signal(8)
+        s = Signal((8, True))
+        x = Signal(8)
+        comb = self._fold([
+            If(C(1), x.eq(Mux(C(0), a, b))).Else(x.eq(a)),
+            Case(C(2, 2), {1: x.eq(1), 2: x.eq(Array([a, b])[C(1)]),
+                           "default": x.eq(0)}),
+            If(a, x.eq(Mux(C(1), a, s))),
+            x.eq(Mux(C(1), C(-1), a)),
+        ])
+        self.assertEqual(len(comb), 4)
+        self.assertIs(comb[0].r, b)
+        self.assertIs(comb[1].r, b)
+        # different signedness, not simplified
+        self.assertIsInstance(comb[2], If)
+        self.assertIsNot(comb[2].t[0].r, a)
+        # constants take the width and signedness of the Mux
+        r = comb[3].r
+        self.assertEqual((r.value, r.nbits, r.signed), (-1, 9, True))
+
+    def test_widths(self):
+        a = Signal(2)
+        b = Signal(4)
+        x = Signal(8)
+        comb = self._fold([
+            x.eq(Cat(Mux(C(1), a, b), C(1, 1))),
+            x.eq(Cat(Array([a, b])[C(0) | C(0)], C(1, 1))),
+            x.eq(Cat(Mux(C(1), C(1, 2), b), C(1, 1))),
+        ])
+        # the narrower operand would move the bits above it
+        self.assertEqual(len(comb[0].r.l[0]), 4)
+        self.assertEqual(len(comb[1].r.l[0]), 4)
+        r = comb[2].r
+        self.assertEqual((r.value, r.nbits), (17, 5))
+
+        def module():
+            m = Module()
+            m.comb += x.eq(Cat(Mux(1, a, b), C(1, 1)))
+            return m
+        trace = []
+
+        def gen():
+            yield a.eq(1)
+            yield
+            trace.append((yield x))
+        for simplify in False, True:
+            run_simulation(module(), gen(), simplify=simplify)
+        self.assertEqual(trace, [17, 17])
+        src = verilog.convert(module(), {a, b, x}, simplify=True).main_source
+        self.assertNotIn("{1'd1, a}", src)
+
+    def test_zero_width(self):
+        x = Signal(8)
+        y = Signal(8)
+        comb = self._fold([
+            x.eq(Cat(C(5, 8)[3:3], y)),
+            x.eq(Cat(Cat(), y)),
+            x.eq(Cat(Replicate(C(1, 1), 0), y)),
+        ])
+        self.assertEqual([len(s.r.l[0]) for s in comb], [0, 0, 0])
+
+        def module():
+            m = Module()
+            m.comb += x.eq(Cat(C(5, 8)[3:3], Cat(), Replicate(C(1, 1), 0),
+                               y))
+            return m
+        trace = []
+
+        def gen():
+            yield y.eq(7)
+            yield
+            trace.append((yield x))
+        run_simulation(module(), gen(), simplify=True)
+        self.assertEqual(trace, [7])
+        verilog.convert(module(), {x, y}, simplify=True)
+
+    def test_simulation(self):
+        self.assertEqual(_run(0, simplify=True), _run(0))
+
+
+class DeadLogicCase(unittest.TestCase):
+    def test_observed(self):
+        m = Module()
+        a = Signal(8)
+        b = Signal(8)
+        c = Signal(8)
+        dead = Signal(8)
+        counter = Signal(8)
+        m.comb += [b.eq(a + 1), dead.eq(b)]
+        m.sync += [c.eq(b), counter.eq(counter + 1)]
+        f = remove_dead_logic(m.get_fragment(), {c})
+        self.assertEqual(len(f.comb), 1)
+        self.assertIs(f.comb[0].l, b)
+        self.assertEqual(len(f.sync["sys"]), 1)
+        self.assertIs(f.sync["sys"][0].l, c)
+
+    def test_simulation(self):
+        trace = []
+        dut = Kitchensink()
+        run_simulation(dut, _stimulus(dut, trace, 1),
+                       simplify=set(dut.outputs))
+        self.assertEqual(trace, _run(1))
+
+    def test_convert(self):
+        m = Module()
+        a = Signal(8)
+        x = Signal(8)
+        unused = Signal(8)
+        m.comb += [x.eq(a + 1), unused.eq(a + 2)]
+        src = verilog.convert(m, {a, x}, simplify=True).main_source
+        self.assertIn("assign x", src)
+        self.assertNotIn("unused", src)
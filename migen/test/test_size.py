@@ -17,3 +17,17 @@ class SignalSizeCase(unittest.TestCase):
         self.assertEqual(len(self.s), 13)
         self.assertEqual(len(self.i), 8)
         self.assertEqual(len(self.j), 8)
+
+
+class FootprintCase(unittest.TestCase):
+    def test_no_instance_dicts(self):
+        s = Signal(8)
+        nodes = [C(3), s + 1, s[2:5], s.part(C(1), 2), Cat(s, s),
+                 Replicate(s, 2), s.eq(1), If(s, s.eq(0)), Case(s, {})]
+        for node in nodes:
+            self.assertFalse(hasattr(node, "__dict__"), type(node))
+
+    def test_signal_attributes(self):
+        s = Signal(8)
+        s.foo = 1
+        self.assertEqual(s.foo, 1)
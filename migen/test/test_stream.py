@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from migen import *  # noqa
+from migen.genlib.fifo import SyncFIFO, AsyncFIFO
+from migen.genlib.record import Record
+from migen.sim.stream import StreamDriver, StreamMonitor
+
+
+class StreamCase(unittest.TestCase):
+    def test_sync_fifo(self):
+        fifo = SyncFIFO(16, 4)
+        payloads = np.arange(1000, dtype=np.uint16) * 7
+        driver = StreamDriver.for_fifo(fifo, payloads)
+        monitor = StreamMonitor.for_fifo(fifo, count=len(payloads))
+        run_simulation(fifo, [driver.generator(), monitor.generator()])
+        np.testing.assert_array_equal(monitor.results, payloads)
+        self.assertEqual(driver.transfers, 1000)
+        self.assertEqual(monitor.transfers, 1000)
+        self.assertGreater(driver.throughput, 0.9)
+
+    def test_backpressure(self):
+        fifo = SyncFIFO(8, 2)
+        payloads = list(range(100))
+        driver = StreamDriver.for_fifo(fifo, payloads)
+        monitor = StreamMonitor(fifo.dout, fifo.readable, fifo.re,
+                                count=len(payloads))
+
+        def reader():
+            for cycle in range(1000):
+                yield fifo.re.eq(cycle % 3 == 0)
+                yield
+        run_simulation(fifo, [driver.generator(), monitor.generator(),
+                              reader()])
+        self.assertEqual(list(monitor.results), payloads)
+        self.assertGreater(driver.stalls, 0)
+        self.assertAlmostEqual(driver.throughput, 1 / 3, places=1)
+        self.assertEqual(driver.cycles, driver.transfers + driver.stalls)
+
+    def test_async_fifo_record(self):
+        layout = [("address", 8), ("data", 24)]
+        fifo = ClockDomainsRenamer({"write": "sys", "read": "slow"})(
+            AsyncFIFO(32, 8))
+        source = Record(layout)
+        sink = Record(layout)
+        fifo.comb += [fifo.din.eq(source.raw_bits()),
+                      sink.raw_bits().eq(fifo.dout)]
+        payloads = [(i << 8) | (i % 256) for i in range(200)]
+        driver = StreamDriver(source, fifo.we, fifo.writable, payloads)
+        monitor = StreamMonitor(sink, fifo.readable, fifo.re,
+                                drive_ready=True)
+        run_simulation(fifo, {"sys": driver.generator(),
+                              "slow": monitor.generator()},
+                       clocks={"sys": 10, "slow": 23})
+        # the passive monitor stops with the driver, before the FIFO is
+        # drained
+        self.assertGreater(len(monitor.results), 150)
+        self.assertEqual(monitor.results, payloads[:len(monitor.results)])
@@ -0,0 +1,90 @@
+import gc
+import pickle
+import time
+import unittest
+import weakref
+
+from migen import *  # noqa
+from migen.fhdl import tracer
+from migen.fhdl.namer import build_namespace
+
+
+class _Sub(Module):
+    def __init__(self):
+        self.a = Signal()
+        self._bar = Signal()
+
+
+class _Top(Module):
+    def __init__(self):
+        self.submodules.first = _Sub()
+        self.submodules.second = _Sub()
+        self.c = Signal(name="c")
+
+
+class TracerCase(unittest.TestCase):
+    def test_backtrace(self):
+        top = _Top()
+        self.assertEqual([name for name, n in top.first.a.backtrace[-4:]],
+                         ["top", "first", "sub", "a"])
+        self.assertEqual(top.first._bar.backtrace[-1][0], "bar")
+        self.assertEqual(top.c.backtrace[-1][0], "c")
+        # the same object has the same number in all backtraces
+        self.assertEqual(top.first.a.backtrace[-2],
+                         top.first._bar.backtrace[-2])
+        self.assertNotEqual(top.first.a.backtrace[-2],
+                            top.second.a.backtrace[-2])
+
+    def test_names_do_not_depend_on_build_order(self):
+        names = []
+        for order in 1, -1:
+            top = _Top()
+            signals = [top.first.a, top.second.a, top.first._bar,
+                       top.second._bar, top.c]
+            for signal in signals[::order]:
+                signal.backtrace
+            ns = build_namespace(signals)
+            names.append([ns.get_name(s) for s in signals])
+        self.assertEqual(names[0], names[1])
+        self.assertEqual(names[0][:2], ["first_a", "second_a"])
+
+    def test_pickle(self):
+        signal = Signal()
+        backtrace = pickle.loads(pickle.dumps(signal)).backtrace
+        self.assertEqual(backtrace, signal.backtrace)
+
+    def test_disabled(self):
+        tracer.enabled = False
+        try:
+            signal = Signal(name="x")
+            anonymous = Signal()
+        finally:
+            tracer.enabled = True
+        self.assertEqual(signal.backtrace[0][0], "x")
+        self.assertEqual(len(signal.backtrace), 1)
+        self.assertEqual(anonymous.backtrace[0][0], "anonymous")
+
+    def test_objects_are_released(self):
+        sub = _Sub()
+        ref = weakref.ref(sub)
+        signal = sub.a
+        del sub
+        gc.collect()
+        self.assertIsNone(ref())
+        # a new object reusing the id gets a new number
+        numbers = {signal.backtrace[-2][1], _Sub().a.backtrace[-2][1]}
+        self.assertEqual(len(numbers), 2)
+
+    def test_linear_scaling(self):
+        def elaborate(n):
+            start = time.perf_counter()
+            top = Module()
+            for i in range(n):
+                top.submodules += _Sub()
+            top.get_fragment()
+            return time.perf_counter() - start
+
+        # (a quadratic cost would make the second run 64 times slower)
+        elaborate(100)
+        ratio = elaborate(3200) / elaborate(400)
+        self.assertLess(ratio, 24)
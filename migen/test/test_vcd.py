@@ -0,0 +1,92 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from migen import *  # noqa
+
+
+class _Counter(Module):
+    def __init__(self):
+        self.count = Signal(4, reset=3)
+        self.sync += self.count.eq(self.count + 1)
+
+
+def _run(vcd_name, cycles=3, **kwargs):
+    def gen():
+        for i in range(cycles):
+            yield
+    dut = _Counter()
+    run_simulation(dut, gen(), vcd_name=vcd_name, **kwargs)
+    return dut
+
+
+def _read(vcd_name):
+    with open(vcd_name) as f:
+        return f.read().splitlines()
+
+
+class VCDCase(unittest.TestCase):
+    expected = [
+        "$var wire 4 ! count $end",
+        "$var wire 1 \" sys_clk $end",
+        "$dumpvars", "b0011 !", "0\"", "$end",
+        "#0", "#5", "b0100 !", "1\"", "#10", "0\"", "#15", "b0101 !", "1\"",
+        "#20", "0\"", "#25", "b0110 !", "1\"", "#30", "0\"", "#35", "b0111 !",
+        "1\""
+    ]
+
+    def test_plain(self):
+        with tempfile.TemporaryDirectory() as d:
+            vcd_name = os.path.join(d, "counter.vcd")
+            _run(vcd_name)
+            self.assertEqual(_read(vcd_name), self.expected)
+
+    def test_gzip(self):
+        with tempfile.TemporaryDirectory() as d:
+            vcd_name = os.path.join(d, "counter.vcd.gz")
+            _run(vcd_name)
+            with gzip.open(vcd_name, "rt") as f:
+                self.assertEqual(f.read().splitlines(), self.expected)
+
+    def test_patterns(self):
+        with tempfile.TemporaryDirectory() as d:
+            vcd_name = os.path.join(d, "counter.vcd")
+            _run(vcd_name, vcd_signals=["c*"])
+            self.assertEqual(_read(vcd_name), [
+                "$var wire 4 ! count $end",
+                "$dumpvars", "b0011 !", "$end",
+                "#0", "#5", "b0100 !", "#15", "b0101 !", "#25", "b0110 !",
+                "#35", "b0111 !"
+            ])
+
+    def test_window(self):
+        with tempfile.TemporaryDirectory() as d:
+            vcd_name = os.path.join(d, "counter.vcd")
+            _run(vcd_name, vcd_signals=["count"], vcd_start=10, vcd_stop=20)
+            self.assertEqual(_read(vcd_name), [
+                "$var wire 4 ! count $end",
+                "$dumpvars", "b0011 !", "$end",
+                "#0", "$dumpoff", "bx !", "$end",
+                "#10", "$dumpon", "b0100 !", "$end",
+                "#15", "b0101 !",
+                "#20", "$dumpoff", "bx !", "$end"
+            ])
+
+    def test_trigger(self):
+        with tempfile.TemporaryDirectory() as d:
+            vcd_name = os.path.join(d, "counter.vcd")
+            shadow = Signal(4)
+            dut = _Counter()
+            dut.comb += shadow.eq(dut.count)
+
+            def gen():
+                for i in range(4):
+                    yield
+            run_simulation(dut, gen(), vcd_name=vcd_name,
+                           vcd_signals=["shadow"], vcd_trigger=shadow == 5)
+            self.assertEqual(_read(vcd_name)[4:], [
+                "#0", "$dumpoff", "bx !", "$end",
+                "#15", "$dumpon", "b0101 !", "$end",
+                "#25", "b0110 !", "#35", "b0111 !", "#45", "b1000 !"
+            ])
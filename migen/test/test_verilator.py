@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from migen import *  # noqa
+from migen.fhdl.namer import build_namespace
+from migen.fhdl.specials import _MemoryLocation
+from migen.sim.verilator import (VerilatorEvaluator, VerilatorSimulator,
+                                 run_verilator_simulation)
+from migen.test.test_sim import Kitchensink, _stimulus, _run
+
+
+@unittest.skipUnless(shutil.which("verilator"), "Verilator not found")
+class VerilatorCase(unittest.TestCase):
+    def test_matches_simulator(self):
+        with tempfile.TemporaryDirectory() as build_dir:
+            for seed in range(2):
+                trace = []
+                dut = Kitchensink()
+                run_verilator_simulation(dut, _stimulus(dut, trace, seed),
+                                         build_dir=build_dir)
+                self.assertEqual(trace, _run(seed))
+            # the second run reused the library built by the first one
+            self.assertEqual(len(os.listdir(build_dir)), 1)
+
+
+class _FakeModel:
+    """Model with the interface of the Verilated library"""
+    def __init__(self, names, depth=0):
+        self.values = {"top." + name: 0 for name in names}
+        self.words = [0] * depth
+        self.puts = []
+
+    def handle(self, name):
+        return name if name in self.values else None
+
+    def word(self, memory, index):
+        return memory, index
+
+    def get(self, handle, nbits):
+        if isinstance(handle, tuple):
+            return self.words[handle[1]]
+        return self.values[handle]
+
+    def put(self, handle, nbits, value):
+        self.puts.append((handle, value))
+        if isinstance(handle, tuple):
+            self.words[handle[1]] = value
+        else:
+            self.values[handle] = value
+
+
+class VerilatorEvaluatorCase(unittest.TestCase):
+    def setUp(self):
+        self.a = Signal(8)
+        self.b = Signal((4, True))
+        self.testbench = Signal(8)
+        self.mem = Memory(8, 4)
+        ns = build_namespace([self.a, self.b])
+        # memories are named when their Verilog is printed
+        self.model = _FakeModel([ns.get_name(obj)
+                                 for obj in (self.a, self.b, self.mem)],
+                                depth=4)
+        self.evaluator = VerilatorEvaluator([], self.model, ns)
+
+    def test_signals(self):
+        e, model = self.evaluator, self.model
+        model.values["top.b"] = 0xe
+        self.assertEqual(e.eval(self.b), -2)
+        e.assign(self.a[4:], 3)
+        e.assign(self.testbench, 7)
+        # writes only take effect with the commit
+        self.assertEqual(e.eval(self.a), 0)
+        self.assertEqual(e.eval(self.a, True), 0x30)
+        self.assertEqual(e.eval(self.testbench), 0)
+        self.assertEqual(model.puts, [])
+        self.assertEqual(e.commit(), [])
+        self.assertEqual(model.puts, [("top.a", 0x30)])
+        self.assertEqual(e.eval(self.a), 0x30)
+        self.assertEqual(e.eval(self.testbench), 7)
+        self.assertEqual(e.dirty_slots, set())
+
+    def test_memory(self):
+        e, model = self.evaluator, self.model
+        location = _MemoryLocation(self.mem, C(2))
+        e.assign(location, 0x1ff)
+        self.assertEqual(e.eval(location), 0)
+        self.assertEqual(e.eval(location, True), 0xff)
+        e.commit()
+        self.assertEqual(model.words, [0, 0, 0xff, 0])
+        with self.assertRaises(IndexError):
+            e.eval(_MemoryLocation(self.mem, C(4)))
+
+
+class VerilatorOptionsCase(unittest.TestCase):
+    def test_unsupported(self):
+        m = Module()
+        m.sync += Signal().eq(1)
+        with self.assertRaises(NotImplementedError):
+            VerilatorSimulator(m, [], vcd_name="x.vcd")
+        with self.assertRaises(TypeError):
+            VerilatorSimulator(m, [], vcd="x.vcd")